@@ -7,13 +7,29 @@ For more information on this file, see
 https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
 """
 
+import logging
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 from mangum import Mangum
 
+from SkagitRegistration import warmup
+
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "SkagitRegistration.settings")
 
 application = get_asgi_application()
 
-handler = Mangum(application, lifespan="off")
+logging.getLogger(__name__).info(
+    "Loaded secrets from %s in %.1f ms",
+    settings.ENV_SECRETS_LOAD.source,
+    settings.ENV_SECRETS_LOAD.seconds * 1000,
+)
+
+mangum_handler = Mangum(application, lifespan="off")
+
+
+def handler(event, context):
+    if warmup.is_warmup_event(event):
+        return warmup.warm_up(event)
+    return mangum_handler(event, context)
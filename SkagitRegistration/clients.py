@@ -0,0 +1,39 @@
+"""stripe and boto3, imported on first use to keep them out of cold starts."""
+
+import importlib
+
+
+class LazyModule:
+    def __init__(self, name, configure=None):
+        self._name = name
+        self._configure = configure
+        self._module = None
+
+    @property
+    def is_loaded(self):
+        return self._module is not None
+
+    def _load(self):
+        if self._module is None:
+            module = importlib.import_module(self._name)
+            if self._configure is not None:
+                self._configure(module)
+            self._module = module
+        return self._module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __repr__(self):
+        state = "loaded" if self.is_loaded else "not loaded"
+        return f"<LazyModule {self._name} ({state})>"
+
+
+def _configure_stripe(module):
+    from django.conf import settings
+
+    module.api_key = settings.STRIPE_API_KEY
+
+
+stripe = LazyModule("stripe", configure=_configure_stripe)
+boto3 = LazyModule("boto3")
@@ -0,0 +1,81 @@
+"""Times a cold start of the web handler, run by ``benchmark_cold_start``."""
+
+import argparse
+import json
+import time
+import uuid
+
+
+def api_gateway_event(path, host):
+    now = time.time()
+    return {
+        "version": "2.0",
+        "routeKey": "$default",
+        "rawPath": path,
+        "rawQueryString": "",
+        "headers": {
+            "host": host,
+            "x-forwarded-proto": "https",
+            "x-forwarded-port": "443",
+            "user-agent": "cold-start-probe",
+        },
+        "requestContext": {
+            "accountId": "000000000000",
+            "apiId": "probe",
+            "domainName": host,
+            "domainPrefix": host.split(".")[0],
+            "http": {
+                "method": "GET",
+                "path": path,
+                "protocol": "HTTP/1.1",
+                "sourceIp": "127.0.0.1",
+                "userAgent": "cold-start-probe",
+            },
+            "requestId": str(uuid.uuid4()),
+            "routeKey": "$default",
+            "stage": "$default",
+            "time": time.strftime("%d/%b/%Y:%H:%M:%S +0000", time.gmtime(now)),
+            "timeEpoch": int(now * 1000),
+        },
+        "isBase64Encoded": False,
+    }
+
+
+class LambdaContext:
+    function_name = "cold-start-probe"
+    aws_request_id = "cold-start-probe"
+
+    @staticmethod
+    def get_remaining_time_in_millis():
+        return 30_000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", default="/")
+    parser.add_argument("--host", default="localhost")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    from SkagitRegistration import asgi
+
+    imported = time.perf_counter()
+    response = asgi.handler(api_gateway_event(args.path, args.host), LambdaContext())
+    first_request = time.perf_counter()
+    asgi.handler(api_gateway_event(args.path, args.host), LambdaContext())
+    second_request = time.perf_counter()
+
+    print(
+        json.dumps(
+            {
+                "status_code": response["statusCode"],
+                "import_seconds": imported - start,
+                "first_request_seconds": first_request - imported,
+                "warm_request_seconds": second_request - first_request,
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""PostgreSQL backend that reuses connections across requests on Lambda."""
+
+import logging
+import threading
+import time
+
+from django.core.signals import request_finished
+from django.db import connections
+from django.db.backends.postgresql import base
+
+logger = logging.getLogger(__name__)
+
+# Lambda serves one request at a time per instance, so one idle connection per
+# alias is all that a request can pick up
+MAX_IDLE_CONNECTIONS = 1
+
+connection_stats = {"opened": 0, "open_seconds": 0.0, "reused": 0}
+
+# The ASGI handler runs each request in a new thread, so a persistent connection
+# is parked here at the end of a request for the next one to pick up
+_idle_connections = {}
+_idle_lock = threading.Lock()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_new_connection(self, conn_params):
+        idle = self._take_idle_connection()
+        if idle is not None:
+            connection, self.isolation_level, self.opened_at = idle
+            connection_stats["reused"] += 1
+            return connection
+
+        start = time.perf_counter()
+        connection = super().get_new_connection(conn_params)
+        seconds = time.perf_counter() - start
+        self.opened_at = time.monotonic()
+        connection_stats["opened"] += 1
+        connection_stats["open_seconds"] += seconds
+        logger.debug(
+            "Opened database connection %s in %.1f ms", self.alias, seconds * 1000
+        )
+        return connection
+
+    def connect(self):
+        super().connect()
+        # connect() starts the maximum age over, a reused connection keeps its own
+        max_age = self.settings_dict["CONN_MAX_AGE"]
+        if max_age is not None:
+            self.close_at = self.opened_at + max_age
+
+    def _take_idle_connection(self):
+        while True:
+            with _idle_lock:
+                idle = _idle_connections.get(self.alias)
+                if not idle:
+                    return None
+                connection, isolation_level, opened_at = idle.pop()
+            if self._idle_connection_usable(connection, opened_at):
+                return connection, isolation_level, opened_at
+            connection.close()
+
+    def _idle_connection_usable(self, connection, opened_at):
+        max_age = self.settings_dict["CONN_MAX_AGE"]
+        if connection.closed or (
+            max_age is not None and time.monotonic() >= opened_at + max_age
+        ):
+            return False
+        if not self.settings_dict["CONN_HEALTH_CHECKS"]:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+        except self.Database.Error:
+            return False
+        return True
+
+    def park(self):
+        """Hand the open connection to the next request in this process."""
+        if (
+            self.connection is None
+            or self.in_atomic_block
+            or self.errors_occurred
+            or not self.get_autocommit()
+        ):
+            return
+        with _idle_lock:
+            idle = _idle_connections.setdefault(self.alias, [])
+            if len(idle) < MAX_IDLE_CONNECTIONS:
+                idle.append((self.connection, self.isolation_level, self.opened_at))
+                self.connection = None
+                return
+        self.close()
+
+
+def close_idle_connections():
+    with _idle_lock:
+        idle = [entry for entries in _idle_connections.values() for entry in entries]
+        _idle_connections.clear()
+    for connection, _, _ in idle:
+        connection.close()
+
+
+def park_connections(**kwargs):
+    # Runs after Django's close_old_connections, so only connections that are
+    # still usable and within CONN_MAX_AGE are left open to park
+    for connection in connections.all(initialized_only=True):
+        if isinstance(connection, DatabaseWrapper):
+            connection.park()
+
+
+request_finished.connect(park_connections)
@@ -0,0 +1,97 @@
+"""Loads secrets from ENV_SECRETS_FILE, a temp file cache or Secrets Manager."""
+
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+AWS_REGION = "us-west-2"
+
+
+class SecretsLoad(NamedTuple):
+    source: str
+    seconds: float
+
+
+def load_env_secrets():
+    start = time.perf_counter()
+    secrets_file = os.getenv("ENV_SECRETS_FILE")
+    if secrets_file:
+        secrets = json.loads(Path(secrets_file).read_text())
+        source = "file"
+    else:
+        secrets_id = os.environ["AWS_SECRETS_CONFIG_NAME"]
+        secrets = _read_cache(secrets_id)
+        source = "cache"
+        if secrets is None:
+            secrets = _fetch_secrets(secrets_id)
+            source = "secretsmanager"
+            _write_cache(secrets_id, secrets)
+    os.environ.update(secrets)
+    return SecretsLoad(source, time.perf_counter() - start)
+
+
+def _fetch_secrets(secrets_id):
+    from SkagitRegistration.clients import boto3
+
+    client = boto3.session.Session().client(
+        service_name="secretsmanager", region_name=AWS_REGION
+    )
+    return json.loads(client.get_secret_value(SecretId=secrets_id)["SecretString"])
+
+
+def _cache_seconds():
+    return float(os.getenv("ENV_SECRETS_CACHE_SECONDS", 0))
+
+
+def _private(info):
+    return info.st_uid == os.getuid() and not info.st_mode & 0o077
+
+
+def _cache_path(secrets_id):
+    # The temp directory is shared, so only use a directory that only we can read
+    cache_dir = Path(tempfile.gettempdir()) / "env-secrets"
+    try:
+        cache_dir.mkdir(mode=0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(cache_dir)
+    if not stat.S_ISDIR(info.st_mode) or not _private(info):
+        raise PermissionError(f"{cache_dir} is not a private directory")
+    digest = hashlib.sha256(secrets_id.encode()).hexdigest()[:16]
+    return cache_dir / f"{digest}.json"
+
+
+def _read_cache(secrets_id):
+    if _cache_seconds() <= 0:
+        return None
+    try:
+        fd = os.open(_cache_path(secrets_id), os.O_RDONLY | os.O_NOFOLLOW)
+        with os.fdopen(fd) as cache_file:
+            info = os.fstat(fd)
+            if not _private(info) or time.time() - info.st_mtime > _cache_seconds():
+                return None
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_cache(secrets_id, secrets):
+    if _cache_seconds() <= 0:
+        return
+    try:
+        cache_path = _cache_path(secrets_id)
+        # mkstemp creates the file with O_EXCL | O_NOFOLLOW and mode 0600
+        fd, partial_path = tempfile.mkstemp(dir=cache_path.parent, suffix=".tmp")
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, "w") as cache_file:
+            json.dump(secrets, cache_file)
+        os.replace(partial_path, cache_path)
+    except OSError:
+        Path(partial_path).unlink(missing_ok=True)
@@ -1,27 +1,15 @@
-import json
 import os
 from distutils.util import strtobool
 from pathlib import Path
 
-import boto3
 import dj_database_url
-import sentry_sdk
-import stripe
 from django.contrib.messages import constants as messages
 from django.urls import reverse_lazy
-from sentry_sdk.integrations.django import DjangoIntegration
-
-ENV_SECRETS_ID = os.environ["AWS_SECRETS_CONFIG_NAME"]
-AWS_REGION = "us-west-2"
-aws_session = boto3.session.Session()
-client = aws_session.client(
-    service_name="secretsmanager",
-    region_name=AWS_REGION,
-)
-env_secrets = json.loads(
-    client.get_secret_value(SecretId=ENV_SECRETS_ID)["SecretString"]
-)
-os.environ.update(env_secrets)
+
+from SkagitRegistration import env_secrets
+
+AWS_REGION = env_secrets.AWS_REGION
+ENV_SECRETS_LOAD = env_secrets.load_env_secrets()
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -104,7 +92,20 @@ TEMPLATES = [
 WSGI_APPLICATION = "SkagitRegistration.wsgi.application"
 
 DATABASE_URL = os.getenv("DATABASE_URL")
-DATABASES = {"default": dj_database_url.parse(DATABASE_URL)}
+DATABASES = {
+    "default": dj_database_url.parse(
+        DATABASE_URL,
+        conn_max_age=int(os.getenv("DB_CONN_MAX_AGE", 0)),
+        conn_health_checks=strtobool(os.getenv("DB_CONN_HEALTH_CHECKS", "false")),
+    )
+}
+# Postgres connections are parked between requests by the Lambda aware backend
+if DATABASES["default"]["ENGINE"] == "django.db.backends.postgresql":
+    DATABASES["default"]["ENGINE"] = "SkagitRegistration.db"
+# Supabase's transaction pooler hands each transaction to any server connection,
+# so cursors cannot outlive a transaction
+if strtobool(os.getenv("DB_TRANSACTION_POOLER", "false")):
+    DATABASES["default"]["DISABLE_SERVER_SIDE_CURSORS"] = True
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -193,14 +194,22 @@ REST_FRAMEWORK = {
 
 PHONENUMBER_DEFAULT_REGION = "US"
 
+CACHE_VERSION_CHECK_SECONDS = float(os.getenv("CACHE_VERSION_CHECK_SECONDS", 5))
+
+WEB_LAMBDA_FUNCTION_NAME = os.getenv("WEB_LAMBDA_FUNCTION_NAME")
+PREWARM_CONCURRENCY = int(os.getenv("PREWARM_CONCURRENCY", 10))
+
 STRIPE_API_KEY = os.getenv("STRIPE_API_KEY")
 STRIPE_PUBLIC_API_KEY = os.getenv("STRIPE_PUBLIC_API_KEY")
 STRIPE_ENDPOINT_SECRET = os.getenv("STRIPE_ENDPOINT_SECRET")
-stripe.api_key = STRIPE_API_KEY
-
-sentry_sdk.init(
-    dsn=os.getenv("SENTRY_DSN"),
-    integrations=[DjangoIntegration()],
-    traces_sample_rate=float(os.getenv("SENTRY_SAMPLE_RATE", 0)),
-    send_default_pii=True,
-)
+
+if SENTRY_DSN := os.getenv("SENTRY_DSN"):
+    import sentry_sdk
+    from sentry_sdk.integrations.django import DjangoIntegration
+
+    sentry_sdk.init(
+        dsn=SENTRY_DSN,
+        integrations=[DjangoIntegration()],
+        traces_sample_rate=float(os.getenv("SENTRY_SAMPLE_RATE", 0)),
+        send_default_pii=True,
+    )
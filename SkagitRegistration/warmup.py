@@ -0,0 +1,42 @@
+"""Warmup invocations of the web Lambda, sent by ``prewarm_lambdas``."""
+
+import time
+import uuid
+
+from django.core.signals import request_finished
+from django.db import connection
+
+WARMUP_KEY = "warmup"
+
+INSTANCE_ID = uuid.uuid4().hex
+_warmed = False
+
+
+def warmup_event(hold_seconds):
+    return {WARMUP_KEY: {"hold_seconds": hold_seconds}}
+
+
+def is_warmup_event(event):
+    return isinstance(event, dict) and WARMUP_KEY in event
+
+
+def warm_up(event):
+    from registration import catalog, models
+
+    global _warmed
+    start = time.perf_counter()
+    cold = not _warmed
+
+    connection.ensure_connection()
+    models.RegistrationSettings.load()
+    catalog.catalog_cache.get()
+    models.PrerequisiteGraph.load()
+    # Park the connection for the first real request, like the end of a request
+    request_finished.send(sender=__name__)
+    _warmed = True
+
+    seconds = time.perf_counter() - start
+    # Stay busy so the concurrent warmups are spread over separate instances
+    hold_seconds = event[WARMUP_KEY].get("hold_seconds", 0)
+    time.sleep(max(hold_seconds - seconds, 0))
+    return {"instance": INSTANCE_ID, "cold": cold, "seconds": seconds}
@@ -254,7 +254,13 @@ lambda_function: aws.lambda_.Function = aws.lambda_.Function(
     role=lambda_role.arn,
     timeout=30,
     memory_size=512,
-    environment={"variables": {"AWS_SECRETS_CONFIG_NAME": secret_config.name}},
+    environment={
+        "variables": {
+            "AWS_SECRETS_CONFIG_NAME": secret_config.name,
+            "DB_CONN_MAX_AGE": "600",
+            "DB_CONN_HEALTH_CHECKS": "true",
+        }
+    },
     image_config=aws.lambda_.FunctionImageConfigArgs(
         commands=["SkagitRegistration.asgi.handler"]
     ),
@@ -295,6 +301,21 @@ management_lambda_role = aws.iam.Role(
                 }
             ),
         ),
+        aws.iam.RoleInlinePolicyArgs(
+            name="invoke_web_lambda_policy",
+            policy=pulumi.Output.json_dumps(
+                {
+                    "Version": "2012-10-17",
+                    "Statement": [
+                        {
+                            "Effect": "Allow",
+                            "Action": ["lambda:InvokeFunction"],
+                            "Resource": [lambda_function.arn],
+                        }
+                    ],
+                }
+            ),
+        ),
     ],
 )
 
@@ -306,7 +327,12 @@ management_lambda_function: aws.lambda_.Function = aws.lambda_.Function(
     role=management_lambda_role.arn,
     timeout=30,
     memory_size=512,
-    environment={"variables": {"AWS_SECRETS_CONFIG_NAME": secret_config.name}},
+    environment={
+        "variables": {
+            "AWS_SECRETS_CONFIG_NAME": secret_config.name,
+            "WEB_LAMBDA_FUNCTION_NAME": lambda_function.name,
+        }
+    },
     image_config=aws.lambda_.FunctionImageConfigArgs(
         commands=["infra.management_lambdas.management_command"]
     ),
@@ -341,6 +367,13 @@ create_management_event(
     "check_invoice_event_rule", "cron(0 9 * * ? *)", "check_invoices"
 )
 create_management_event("backup_db_rule", "cron(0 10 * * ? *)", "backup_db")
+create_management_event(
+    "sync_seat_counts_rule", "cron(30 10 * * ? *)", "sync_seat_counts"
+)
+create_management_event(
+    "process_stripe_events_rule", "rate(1 minute)", "process_stripe_events"
+)
+create_management_event("prewarm_lambdas_rule", "rate(5 minutes)", "prewarm_lambdas")
 
 api_stage: aws.apigatewayv2.Stage = aws.apigatewayv2.Stage(
     "api_stage", api_id=api_gateway.id, name="$default", auto_deploy=True
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class RegistrationConfig(AppConfig):
     name = "registration"
+
+    def ready(self):
+        # Connects the catalog cache's invalidation signals
+        from registration import catalog  # noqa: F401
@@ -0,0 +1,139 @@
+"""Per-process snapshot of the visible course catalog for the sign up page."""
+
+from django.db.models import Exists, OuterRef, Prefetch
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from registration import models, serializers
+
+
+class CourseEntry:
+    __slots__ = ("id", "specifics", "dates")
+
+    def __init__(self, course):
+        self.id = course.id
+        self.specifics = course.specifics
+        self.dates = serializers.CourseDateSerializer(
+            course.coursedate_set.all(), many=True
+        ).data
+
+
+class CourseTypeEntry:
+    __slots__ = ("id", "fields", "courses")
+
+    def __init__(self, course_type):
+        self.id = course_type.id
+        self.fields = {
+            "name": course_type.name,
+            "abbreviation": course_type.abbreviation,
+            "description": course_type.description,
+            "visible": course_type.visible,
+            "cost": course_type.cost,
+            "cost_human": course_type.cost_human,
+            "requirement": (
+                serializers.RequirementSerializer(course_type.requirement).data
+                if course_type.requirement
+                else None
+            ),
+        }
+        self.courses = tuple(
+            CourseEntry(course) for course in course_type.course_set.all()
+        )
+
+
+class CatalogSnapshot:
+    """Shared between requests, so treat it as read only."""
+
+    __slots__ = ("course_types", "graph")
+
+    def __init__(self, course_types, graph):
+        self.course_types = tuple(course_types)
+        self.graph = graph
+
+    @classmethod
+    def build(cls):
+        course_types = (
+            models.CourseType.objects.filter(visible=True)
+            .order_by("name")
+            .select_related("requirement")
+            .prefetch_related(
+                Prefetch(
+                    "course_set",
+                    queryset=models.Course.objects.order_by("pk").prefetch_related(
+                        "coursedate_set"
+                    ),
+                )
+            )
+        )
+        # Built with the snapshot so it knows every course type listed in it
+        return cls(
+            [CourseTypeEntry(course_type) for course_type in course_types],
+            models.PrerequisiteGraph.build(),
+        )
+
+
+catalog_cache = models.VersionedCache("catalog", CatalogSnapshot.build)
+
+
+@receiver(post_save, sender=models.CourseType)
+@receiver(post_delete, sender=models.CourseType)
+@receiver(post_save, sender=models.Course)
+@receiver(post_delete, sender=models.Course)
+@receiver(post_save, sender=models.CourseDate)
+@receiver(post_delete, sender=models.CourseDate)
+def invalidate_catalog(**kwargs):
+    catalog_cache.invalidate()
+    models.prerequisite_graph_cache.clear()
+
+
+def eligible_courses_data(user):
+    """The snapshot with ``user``'s seats, eligibility and wait lists overlaid."""
+    snapshot = catalog_cache.get()
+    enrolled = models.Course.participants.through.objects.filter(
+        course=OuterRef("pk"), user=user
+    )
+    seats = {
+        course_id: (capacity, participant_count, user_enrolled)
+        for course_id, capacity, participant_count, user_enrolled in (
+            models.Course.objects.filter(type__visible=True)
+            .annotate(user_enrolled=Exists(enrolled))
+            .values_list("id", "capacity", "participant_count", "user_enrolled")
+        )
+    }
+    wait_lists = {
+        course_id: {"id": str(wait_list_id), "course": course_id}
+        for wait_list_id, course_id in models.WaitList.objects.filter(
+            user=user
+        ).values_list("id", "course")
+    }
+    taken_type_ids = models.taken_course_type_ids(user)
+    graph = snapshot.graph
+    taken_mask = graph.mask(taken_type_ids)
+
+    data = []
+    for course_type in snapshot.course_types:
+        course_set = []
+        for course in course_type.courses:
+            if course.id not in seats:
+                continue
+            capacity, participant_count, user_enrolled = seats[course.id]
+            course_set.append(
+                {
+                    "id": str(course.id),
+                    "specifics": course.specifics,
+                    "capacity": capacity,
+                    "spots_left": capacity - participant_count,
+                    "is_full": participant_count >= capacity,
+                    "user_on_wait_list": wait_lists.get(course.id, {"course": None}),
+                    "user_enrolled": user_enrolled,
+                    "coursedate_set": course.dates,
+                }
+            )
+        data.append(
+            {
+                "eligible": graph.is_eligible(course_type.id, taken_mask),
+                **course_type.fields,
+                "course_set": course_set,
+            }
+        )
+    return data
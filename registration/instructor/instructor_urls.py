@@ -18,4 +18,9 @@ url_patterns = [
         instructor_views.participant_csv,
         name="participant_csv",
     ),
+    path(
+        "particpant-csv/all-courses",
+        instructor_views.participant_csv_zip,
+        name="participant_csv_zip",
+    ),
 ]
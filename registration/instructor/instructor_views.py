@@ -1,10 +1,14 @@
 import csv
+import io
+import itertools
+import operator
+import zipfile
 
 from django.contrib.auth.decorators import user_passes_test
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.models import User
-from django.db.models import Q
-from django.http import HttpResponse
+from django.db.models import Max, Min, Prefetch, Q
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.views.generic import TemplateView
 
@@ -23,18 +27,44 @@ class CurrentRegistrationsView(LoginRequiredMixin, UserPassesTestMixin, Template
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["registered_users"] = (
+        registered_users = (
             User.objects.filter(
                 Q(participants__in=models.Course.objects.filter(type__visible=True))
                 | Q(waitlist__isnull=False)
             )
             .distinct()
             .order_by("first_name", "last_name")
+            .prefetch_related(
+                Prefetch(
+                    "participants",
+                    queryset=models.Course.objects.select_related("type"),
+                ),
+                Prefetch(
+                    "waitlist_set",
+                    queryset=models.WaitList.objects.select_related("course__type"),
+                ),
+            )
+        )
+        places = models.WaitList.objects.places()
+        for user in registered_users:
+            for wait_list in user.waitlist_set.all():
+                wait_list.place = places[wait_list.pk]
+        context["registered_users"] = registered_users
+
+        courses = models.Course.objects.annotate(
+            start_date=Min("coursedate__start"), end_date=Max("coursedate__end")
+        ).prefetch_related(
+            "participants",
+            Prefetch(
+                "waitlist_set", queryset=models.WaitList.objects.select_related("user")
+            ),
         )
-        context["course_types"] = models.CourseType.objects.filter(visible=True)
+        context["course_types"] = models.CourseType.objects.filter(
+            visible=True
+        ).prefetch_related(Prefetch("course_set", queryset=courses))
         context["open_waitlist_invoices"] = models.WaitListInvoice.objects.filter(
             voided=False, paid=False
-        )
+        ).select_related("user", "course__type")
         return context
 
 
@@ -49,23 +79,99 @@ class RegistrantView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
         registrant = get_object_or_404(User, username=self.kwargs["username"])
         context["registrant"] = registrant
         context["courses"] = models.Course.objects.filter(participants=registrant)
-        context["wait_list_items"] = models.WaitList.objects.filter(user=registrant)
+        context["wait_list_items"] = models.WaitList.objects.for_user(registrant)
         context["registration_form"] = get_object_or_404(
             models.RegistrationForm, user=registrant
         )
         return context
 
 
+CSV_CHUNK_SIZE = 500
+
+
+class Echo:
+    """File-like object that returns what is written, for streaming csv rows."""
+
+    def write(self, value):
+        return value
+
+
+class ZipStream:
+    """Unseekable buffer for zipfile, drained as the archive is written."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def _csv_file_name(course):
+    return f"{course.type.abbreviation} {course.specifics}".replace("/", "-")
+
+
+def _stream_course_csvs(courses, fields, values):
+    buffer = ZipStream()
+    groups = itertools.groupby(
+        values.iterator(chunk_size=CSV_CHUNK_SIZE), key=operator.itemgetter(0)
+    )
+    group = next(groups, None)
+    with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for course in courses:
+            matched = group is not None and group[0] == course.pk
+            rows = group[1] if matched else ()
+            with io.TextIOWrapper(
+                zf.open(f"{_csv_file_name(course)}.csv", mode="w"),
+                encoding="utf-8",
+                newline="",
+            ) as csv_file:
+                writer = csv.writer(csv_file)
+                writer.writerow(fields)
+                for i, row in enumerate(rows, start=1):
+                    writer.writerow(row[1:])
+                    if i % CSV_CHUNK_SIZE == 0:
+                        csv_file.flush()
+                        yield buffer.drain()
+            if matched:
+                group = next(groups, None)
+            yield buffer.drain()
+    yield buffer.drain()
+
+
 @user_passes_test(instructor_check)
 def participant_csv(request, course_pk):
     course = models.Course.objects.get(pk=course_pk)
-    response = HttpResponse(content_type="text/csv")
-    response["Content-Disposition"] = f'attachment; filename="{course.specifics}.csv"'
     fields, values = models.get_course_participant_values(course)
+    rows = itertools.chain([fields], values.iterator(chunk_size=CSV_CHUNK_SIZE))
 
-    writer = csv.writer(response)
-    writer.writerow(fields)
-    for value in values:
-        writer.writerow(value)
+    writer = csv.writer(Echo())
+    response = StreamingHttpResponse(
+        (writer.writerow(row) for row in rows), content_type="text/csv"
+    )
+    response["Content-Disposition"] = f'attachment; filename="{course.specifics}.csv"'
+    return response
 
+
+@user_passes_test(instructor_check)
+def participant_csv_zip(request):
+    courses = (
+        models.Course.objects.filter(type__visible=True)
+        .select_related("type")
+        .order_by("pk")
+    )
+    fields, values = models.get_courses_participant_values(courses)
+
+    response = StreamingHttpResponse(
+        _stream_course_csvs(courses, fields, values), content_type="application/zip"
+    )
+    response["Content-Disposition"] = 'attachment; filename="participants.zip"'
     return response
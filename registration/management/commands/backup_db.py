@@ -2,10 +2,10 @@ import logging
 import subprocess
 from datetime import datetime, timezone
 
-import boto3
 from django.core.management import BaseCommand
 
 from SkagitRegistration import settings
+from SkagitRegistration.clients import boto3
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -0,0 +1,111 @@
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+PACKAGES = (
+    "django",
+    "rest_framework",
+    "stripe",
+    "boto3",
+    "botocore",
+    "phonenumber_field",
+    "phonenumbers",
+    "localflavor",
+    "mangum",
+    "sentry_sdk",
+    "registration",
+)
+
+
+def parse_import_times(importtime_output):
+    """Seconds spent importing each top level package, from ``-X importtime``."""
+    totals = defaultdict(float)
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, _, module = line[len("import time:") :].split("|")
+        if not self_us.strip().isdigit():
+            continue
+        totals[module.strip().split(".")[0]] += int(self_us) / 1_000_000
+    return totals
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures a cold start of the web Lambda handler in a fresh interpreter: "
+        "import time per package and the first request through Mangum"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", default="/")
+        parser.add_argument("--host", default=settings.ALLOWED_HOSTS[0])
+        parser.add_argument(
+            "--budget",
+            type=float,
+            help="fail if importing and serving the first request takes longer "
+            "than this many milliseconds",
+        )
+
+    def handle(self, *args, **options):
+        host = options["host"] if options["host"] != "*" else "localhost"
+        probe = subprocess.run(
+            [
+                sys.executable,
+                "-X",
+                "importtime",
+                "-m",
+                "SkagitRegistration.cold_start_probe",
+                "--path",
+                options["path"],
+                "--host",
+                host,
+            ],
+            capture_output=True,
+            text=True,
+            cwd=settings.BASE_DIR,
+            env={**os.environ, "DJANGO_SETTINGS_MODULE": settings.SETTINGS_MODULE},
+        )
+        if probe.returncode != 0:
+            raise CommandError(f"The cold start probe failed:\n{probe.stderr[-3000:]}")
+        timings = json.loads(probe.stdout.strip().splitlines()[-1])
+        import_times = parse_import_times(probe.stderr)
+
+        self.stdout.write("Import time by package (self time of its modules):")
+        for package in PACKAGES:
+            self.stdout.write(f"  {package:<20}{import_times[package] * 1000:>9.1f} ms")
+        others = sorted(
+            (
+                (seconds, package)
+                for package, seconds in import_times.items()
+                if package not in PACKAGES
+            ),
+            reverse=True,
+        )
+        self.stdout.write(
+            f"  {'other':<20}{sum(seconds for seconds, _ in others) * 1000:>9.1f} ms"
+            f" (largest: {', '.join(package for _, package in others[:5])})"
+        )
+
+        cold_start = timings["import_seconds"] + timings["first_request_seconds"]
+        self.stdout.write(
+            f"Import SkagitRegistration.asgi: {timings['import_seconds'] * 1000:.1f} ms"
+        )
+        self.stdout.write(
+            f"First request ({options['path']} -> {timings['status_code']}): "
+            f"{timings['first_request_seconds'] * 1000:.1f} ms"
+        )
+        self.stdout.write(
+            f"Warm request: {timings['warm_request_seconds'] * 1000:.1f} ms"
+        )
+        self.stdout.write(f"Cold start total: {cold_start * 1000:.1f} ms")
+
+        if options["budget"] is not None and cold_start * 1000 > options["budget"]:
+            raise CommandError(
+                f"Cold start took {cold_start * 1000:.1f} ms, over the budget of "
+                f"{options['budget']:.1f} ms"
+            )
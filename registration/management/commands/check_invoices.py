@@ -1,10 +1,10 @@
 import logging
 from datetime import datetime, timezone
 
-import stripe
 from django.core.management.base import BaseCommand
 
 from registration import models
+from SkagitRegistration.clients import stripe
 
 
 class Command(BaseCommand):
@@ -0,0 +1,92 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from registration import models
+from SkagitRegistration import warmup
+from SkagitRegistration.clients import boto3
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def upcoming_opening(registration_settings, now, lead):
+    """The registration opening within ``lead`` of ``now``, if any."""
+    for opening in (
+        registration_settings.early_registration_open,
+        registration_settings.registration_open,
+    ):
+        if now <= opening <= now + lead:
+            return opening
+    return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Shortly before early registration or registration opens, invokes the web "
+        "lambda concurrently so registrants land on warm instances"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--lead-minutes",
+            type=int,
+            default=15,
+            help="How long before an opening to start warming instances",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=settings.PREWARM_CONCURRENCY,
+            help="Number of concurrent warmup invocations",
+        )
+        parser.add_argument(
+            "--hold-seconds",
+            type=float,
+            default=2,
+            help="How long each invocation holds its instance",
+        )
+        parser.add_argument(
+            "--force", action="store_true", help="Warm instances even if no opening"
+        )
+
+    def handle(self, *args, **options):
+        function_name = settings.WEB_LAMBDA_FUNCTION_NAME
+        if not function_name:
+            logger.info("WEB_LAMBDA_FUNCTION_NAME is not set, nothing to warm")
+            return
+
+        registration_settings = models.RegistrationSettings.load()
+        opening = registration_settings and upcoming_opening(
+            registration_settings,
+            datetime.now(tz=timezone.utc),
+            timedelta(minutes=options["lead_minutes"]),
+        )
+        if not opening and not options["force"]:
+            logger.info("Registration is not opening soon, nothing to warm")
+            return
+
+        concurrency = options["concurrency"]
+        client = boto3.client("lambda")
+        payload = json.dumps(warmup.warmup_event(options["hold_seconds"]))
+
+        def invoke(_):
+            response = client.invoke(FunctionName=function_name, Payload=payload)
+            if "FunctionError" in response:
+                logger.warning(f"Warmup failed: {response['Payload'].read().decode()}")
+                return None
+            return json.loads(response["Payload"].read())
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = [r for r in executor.map(invoke, range(concurrency)) if r]
+
+        instances = {result["instance"] for result in results}
+        cold = sum(result["cold"] for result in results)
+        logger.info(
+            f"Warmed {len(instances)} instances of {function_name} "
+            f"({cold} cold) ahead of {opening or 'a forced warmup'}"
+        )
@@ -0,0 +1,77 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from registration import models, rest_views
+from SkagitRegistration.clients import stripe
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+MAX_ATTEMPTS = 5
+# Longer than the Lambda timeout, so a claim only lapses once its run is gone
+CLAIM_DURATION = timedelta(minutes=2)
+
+
+class Command(BaseCommand):
+    help = "Fulfills the Stripe webhook events waiting in the inbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-seconds",
+            type=float,
+            default=20,
+            help="stop starting new events after this long (Lambda times out at 30)",
+        )
+
+    @staticmethod
+    def claim_event(attempted):
+        now = timezone.now()
+        with transaction.atomic():
+            stripe_event = (
+                models.StripeEvent.objects.filter(
+                    Q(claimed_until=None) | Q(claimed_until__lt=now),
+                    processed=None,
+                    attempts__lt=MAX_ATTEMPTS,
+                )
+                .exclude(pk__in=attempted)
+                .order_by("received")
+                .select_for_update(skip_locked=True)
+                .first()
+            )
+            if stripe_event is None:
+                return None
+            stripe_event.attempts += 1
+            stripe_event.claimed_until = now + CLAIM_DURATION
+            stripe_event.save(update_fields=["attempts", "claimed_until"])
+        attempted.add(stripe_event.pk)
+        return stripe_event
+
+    @staticmethod
+    def process_event(stripe_event):
+        try:
+            rest_views.process_stripe_event(
+                stripe.Event.construct_from(stripe_event.payload, stripe.api_key)
+            )
+            stripe_event.processed = timezone.now()
+            stripe_event.error = ""
+        except Exception as e:
+            logger.exception(f"Failed to process {stripe_event}")
+            stripe_event.error = repr(e)
+        stripe_event.claimed_until = None
+        stripe_event.save(update_fields=["processed", "error", "claimed_until"])
+
+    def handle(self, *args, **options):
+        deadline = time.monotonic() + options["max_seconds"]
+        attempted = set()
+        while time.monotonic() < deadline:
+            stripe_event = self.claim_event(attempted)
+            if stripe_event is None:
+                break
+            self.process_event(stripe_event)
+        logger.info(f"Attempted {len(attempted)} Stripe events")
@@ -0,0 +1,22 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from registration import models
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes every profile's early registration eligibility, e.g. after "
+        "early signup emails were bulk imported without signals"
+    )
+
+    def handle(self, *args, **options):
+        refreshed = models.Profile.objects.refresh_early_registration()
+        eligible = models.Profile.objects.filter(
+            early_registration_eligible=True
+        ).count()
+        logger.info(f"Refreshed {refreshed} profiles, {eligible} are eligible")
@@ -2,11 +2,11 @@ import logging
 import subprocess
 import tempfile
 
-import boto3
 from django.core.management import BaseCommand, call_command
 from django.db import connection
 
 from SkagitRegistration import settings
+from SkagitRegistration.clients import boto3
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
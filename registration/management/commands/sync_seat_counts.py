@@ -0,0 +1,40 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from registration import models
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class Command(BaseCommand):
+    help = "Verifies the stored course seat counters and repairs any that drifted"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="only report drifted counters, exiting with an error if any exist",
+        )
+
+    def handle(self, *args, **options):
+        drifted = list(models.Course.objects.with_drifted_seats())
+        logger.info(f"{len(drifted)} courses have drifted seat counters")
+
+        for course in drifted:
+            logger.warning(
+                f"{course}: participants {course.participant_count} stored, "
+                f"{course.counted_participants} counted; wait list "
+                f"{course.wait_list_count} stored, {course.counted_wait_list} counted"
+            )
+
+        if options["verify"]:
+            if drifted:
+                raise CommandError("Course seat counters are out of sync")
+            return
+
+        repaired = models.Course.objects.filter(
+            pk__in=[course.pk for course in drifted]
+        ).recount_seats()
+        logger.info(f"Repaired seat counters on {repaired} courses")
@@ -0,0 +1,30 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from registration import models
+from SkagitRegistration.clients import stripe
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class Command(BaseCommand):
+    help = "Creates or updates the Stripe product and price for every course type"
+
+    def handle(self, *args, **options):
+        for course_type in models.CourseType.objects.all():
+            if course_type.stripe_product_id:
+                product = stripe.Product.retrieve(course_type.stripe_product_id)
+                if product.name != course_type.name:
+                    stripe.Product.modify(
+                        course_type.stripe_product_id, name=course_type.name
+                    )
+                    logger.info(f"Renamed the Stripe product for {course_type}")
+            if course_type.sync_stripe_price():
+                logger.info(
+                    f"{course_type} now uses price {course_type.stripe_price_id} "
+                    f"({course_type.cost_human})"
+                )
+            else:
+                logger.info(f"{course_type} is up to date")
@@ -0,0 +1,47 @@
+# Generated by Django 5.1.6 on 2026-10-18 16:18
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_seats(apps, schema_editor):
+    Course = apps.get_model("registration", "Course")
+    WaitList = apps.get_model("registration", "WaitList")
+
+    participants = (
+        Course.participants.through.objects.filter(course=OuterRef("pk"))
+        .values("course")
+        .annotate(total=Count("pk"))
+        .values("total")
+    )
+    wait_list = (
+        WaitList.objects.filter(course=OuterRef("pk"))
+        .values("course")
+        .annotate(total=Count("pk"))
+        .values("total")
+    )
+    Course.objects.update(
+        participant_count=Coalesce(Subquery(participants), 0),
+        wait_list_count=Coalesce(Subquery(wait_list), 0),
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("registration", "0008_registrationform_skagit_county_resident"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="course",
+            name="participant_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="course",
+            name="wait_list_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_seats, migrations.RunPython.noop),
+    ]
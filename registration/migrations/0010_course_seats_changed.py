@@ -0,0 +1,17 @@
+# Generated by Django 5.1.6 on 2026-10-18 16:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("registration", "0009_course_seat_counters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="course",
+            name="seats_changed",
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
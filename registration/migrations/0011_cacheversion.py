@@ -0,0 +1,33 @@
+# Generated by Django 5.1.6 on 2026-10-18 16:25
+
+import uuid
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("registration", "0010_course_seats_changed"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CacheVersion",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("key", models.CharField(max_length=50, unique=True)),
+                ("version", models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.1.6 on 2026-10-18 16:26
+
+import django.db.models.functions.text
+from django.db import migrations, models
+from django.db.models import Case, Exists, OuterRef, Value, When
+from django.db.models.functions import Lower
+
+
+def flag_early_registration(apps, schema_editor):
+    EarlySignupEmail = apps.get_model("registration", "EarlySignupEmail")
+    Profile = apps.get_model("registration", "Profile")
+    RegistrationForm = apps.get_model("registration", "RegistrationForm")
+    User = apps.get_model("auth", "User")
+
+    early_signup_emails = EarlySignupEmail.objects.alias(
+        email_lower=Lower("email")
+    ).filter(email_lower=Lower(OuterRef("email")))
+    early_signup_users = User.objects.filter(
+        Exists(early_signup_emails), pk=OuterRef("user")
+    )
+    skagit_county_residents = RegistrationForm.objects.filter(
+        user=OuterRef("user"), skagit_county_resident=True
+    )
+    Profile.objects.update(
+        early_registration_eligible=Case(
+            When(
+                Exists(early_signup_users) | Exists(skagit_county_residents),
+                then=Value(True),
+            ),
+            default=Value(False),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("registration", "0011_cacheversion"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="profile",
+            name="early_registration_eligible",
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name="earlysignupemail",
+            index=models.Index(
+                django.db.models.functions.text.Lower("email"),
+                name="earlysignup_email_lower_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="previousstudentdiscount",
+            index=models.Index(
+                django.db.models.functions.text.Lower("email"),
+                name="prevdiscount_email_lower_idx",
+            ),
+        ),
+        migrations.RunPython(flag_early_registration, migrations.RunPython.noop),
+    ]
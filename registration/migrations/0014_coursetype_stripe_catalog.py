@@ -0,0 +1,27 @@
+# Generated by Django 5.1.6 on 2026-10-18 16:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("registration", "0013_stripeevent"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="coursetype",
+            name="stripe_price_amount",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="coursetype",
+            name="stripe_price_id",
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name="coursetype",
+            name="stripe_product_id",
+            field=models.CharField(blank=True, max_length=200),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.6 on 2026-10-18 16:31
+
+import uuid
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("registration", "0014_coursetype_stripe_catalog"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StripeCoupon",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("coupon_id", models.CharField(max_length=200, unique=True)),
+                ("percent_off", models.PositiveIntegerField(unique=True)),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.6 on 2026-10-18 16:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("registration", "0015_stripecoupon"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="coursebought",
+            name="amount_paid",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
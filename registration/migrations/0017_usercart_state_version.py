@@ -0,0 +1,17 @@
+# Generated by Django 5.1.6 on 2026-10-18 16:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("registration", "0016_coursebought_amount_paid"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="usercart",
+            name="state_version",
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.6 on 2026-10-18 17:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("registration", "0017_usercart_state_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="stripeevent",
+            name="claimed_until",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
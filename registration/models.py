@@ -1,17 +1,42 @@
 import datetime
+import time
 import uuid
 
-import stripe
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.db import models
-from django.db.models import Case, Max, Min, Q, Sum, Value, When
-from django.db.models.signals import m2m_changed, post_save, pre_delete, pre_save
+from django.db.models import (
+    Case,
+    Count,
+    Exists,
+    F,
+    Max,
+    Min,
+    OuterRef,
+    Prefetch,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+    When,
+    Window,
+)
+from django.db.models.functions import Coalesce, Lower, RowNumber
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
 from django.dispatch import receiver
 from django.utils import timezone
 from localflavor.us import models as us_model
 from phonenumber_field.modelfields import PhoneNumberField
 
+from SkagitRegistration.clients import stripe
+
 GENDER_CHOICES = [
     ("M", "Male"),
     ("F", "Female"),
@@ -30,23 +55,105 @@ class BaseModel(models.Model):
         abstract = True
 
 
+class CacheVersion(BaseModel):
+    """Bumped whenever the data behind a process-wide cache changes."""
+
+    key = models.CharField(max_length=50, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.key}: {self.version}"
+
+    @classmethod
+    def current(cls, key):
+        return cls.objects.filter(key=key).values_list("version", flat=True).first()
+
+    @classmethod
+    def bump(cls, key):
+        cls.objects.get_or_create(key=key)
+        cls.objects.filter(key=key).update(version=F("version") + 1)
+
+
+class VersionedCache:
+    """Caches ``build()`` per process until its ``CacheVersion`` changes."""
+
+    _missing = object()
+
+    def __init__(self, key, build):
+        self.key = key
+        self.build = build
+        self.clear()
+
+    def clear(self):
+        self.value = self._missing
+        self.version = None
+        self.next_check = 0.0
+
+    def get(self):
+        now = time.monotonic()
+        if self.value is self._missing or now >= self.next_check:
+            version = CacheVersion.current(self.key)
+            if self.value is self._missing or version != self.version:
+                self.value = self.build()
+                self.version = version
+            self.next_check = now + settings.CACHE_VERSION_CHECK_SECONDS
+        return self.value
+
+    def invalidate(self):
+        CacheVersion.bump(self.key)
+        self.clear()
+
+
+class EmailQuerySet(models.QuerySet):
+    def with_email(self, email):
+        """Case-insensitive email match that can use the ``lower(email)`` index."""
+        return self.alias(email_lower=Lower("email")).filter(
+            email_lower=Lower(Value(email))
+        )
+
+
+class ProfileQuerySet(models.QuerySet):
+    def with_email(self, email):
+        return self.alias(email_lower=Lower("user__email")).filter(
+            email_lower=Lower(Value(email))
+        )
+
+    def refresh_early_registration(self):
+        early_signup_emails = EarlySignupEmail.objects.alias(
+            email_lower=Lower("email")
+        ).filter(email_lower=Lower(OuterRef("email")))
+        early_signup_users = User.objects.filter(
+            Exists(early_signup_emails), pk=OuterRef("user")
+        )
+        skagit_county_residents = RegistrationForm.objects.filter(
+            user=OuterRef("user"), skagit_county_resident=True
+        )
+        return self.update(
+            early_registration_eligible=Case(
+                When(
+                    Exists(early_signup_users) | Exists(skagit_county_residents),
+                    then=Value(True),
+                ),
+                default=Value(False),
+            )
+        )
+
+
 class Profile(BaseModel):
     user = models.OneToOneField(User, models.CASCADE)
     email_confirmed = models.BooleanField(default=False)
     stripe_customer_id = models.CharField(max_length=200)
+    early_registration_eligible = models.BooleanField(default=False, editable=False)
+
+    objects = ProfileQuerySet.as_manager()
 
     @property
     def is_eligible_for_early_registration(self):
-        return (
-            EarlySignupEmail.objects.filter(email__iexact=self.user.email).exists()
-            or RegistrationForm.objects.filter(
-                user__profile=self, skagit_county_resident=True
-            ).exists()
-        )
+        return self.early_registration_eligible
 
     @property
     def is_eligible_for_registration(self):
-        registration_settings = RegistrationSettings.objects.first()
+        registration_settings = RegistrationSettings.load()
         after_early_sign_up = (
             timezone.now() > registration_settings.early_registration_open
         )
@@ -85,6 +192,13 @@ def add_new_user_items(instance, created, **kwargs):
         UserCart.objects.create(user=instance)
 
 
+@receiver(post_save, sender=User)
+def refresh_early_registration_for_user(instance, created, update_fields, **kwargs):
+    if update_fields is not None and "email" not in update_fields:
+        return
+    Profile.objects.filter(user=instance).refresh_early_registration()
+
+
 class RegistrationSettings(BaseModel):
     early_registration_open = models.DateTimeField()
     early_signup_code = models.CharField(max_length=15, blank=True)
@@ -99,14 +213,51 @@ class RegistrationSettings(BaseModel):
             raise ValidationError("There can be only one RegistrationSettings instance")
         return super(RegistrationSettings, self).save(*args, **kwargs)
 
+    @classmethod
+    def load(cls):
+        return registration_settings_cache.get()
+
+
+registration_settings_cache = VersionedCache(
+    "registration_settings", RegistrationSettings.objects.first
+)
+
+
+@receiver(post_save, sender=RegistrationSettings)
+@receiver(post_delete, sender=RegistrationSettings)
+def invalidate_registration_settings(**kwargs):
+    registration_settings_cache.invalidate()
+
 
 class EarlySignupEmail(BaseModel):
     email = models.EmailField()
 
+    objects = EmailQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(Lower("email"), name="earlysignup_email_lower_idx")]
+
     def __str__(self):
         return self.email
 
 
+@receiver(pre_save, sender=EarlySignupEmail)
+def remember_previous_early_signup_email(instance, **kwargs):
+    instance._previous_email = (
+        EarlySignupEmail.objects.filter(pk=instance.pk)
+        .values_list("email", flat=True)
+        .first()
+    )
+
+
+@receiver(post_save, sender=EarlySignupEmail)
+@receiver(post_delete, sender=EarlySignupEmail)
+def refresh_early_registration_for_email(instance, **kwargs):
+    emails = {instance.email, getattr(instance, "_previous_email", None)} - {None}
+    for email in emails:
+        Profile.objects.with_email(email).refresh_early_registration()
+
+
 class RegistrationForm(BaseModel):
     user = models.OneToOneField(User, models.CASCADE)
     skagit_county_resident = models.BooleanField(default=False)
@@ -137,6 +288,12 @@ class RegistrationForm(BaseModel):
         return f"{self.user.first_name} {self.user.last_name} registration form"
 
 
+@receiver(post_save, sender=RegistrationForm)
+@receiver(post_delete, sender=RegistrationForm)
+def refresh_early_registration_for_form(instance, **kwargs):
+    Profile.objects.filter(user=instance.user_id).refresh_early_registration()
+
+
 def human_readable_cost(value):
     return f"${value / 100:,.2f}"
 
@@ -151,6 +308,9 @@ class CourseType(BaseModel):
     fitness_level = models.TextField(blank=True)
     visible = models.BooleanField(default=True)
     cost = models.PositiveIntegerField()
+    stripe_product_id = models.CharField(max_length=200, blank=True)
+    stripe_price_id = models.CharField(max_length=200, blank=True)
+    stripe_price_amount = models.PositiveIntegerField(null=True, blank=True)
 
     def __str__(self):
         return self.name
@@ -159,6 +319,182 @@ class CourseType(BaseModel):
     def cost_human(self):
         return human_readable_cost(self.cost)
 
+    @property
+    def stripe_price_synced(self):
+        return bool(self.stripe_price_id) and self.stripe_price_amount == self.cost
+
+    def sync_stripe_price(self):
+        """Create any missing Stripe product or price, returning if it did."""
+        update_fields = []
+        if not self.stripe_product_id:
+            product = stripe.Product.create(
+                name=self.name, metadata={"course_type_id": str(self.id)}
+            )
+            self.stripe_product_id = product.id
+            update_fields.append("stripe_product_id")
+        if not self.stripe_price_synced:
+            price = stripe.Price.create(
+                product=self.stripe_product_id, unit_amount=self.cost, currency="usd"
+            )
+            if self.stripe_price_id:
+                stripe.Price.modify(self.stripe_price_id, active=False)
+            self.stripe_price_id = price.id
+            self.stripe_price_amount = self.cost
+            update_fields += ["stripe_price_id", "stripe_price_amount"]
+        # Saving invalidates the catalog cache, so only save real changes
+        if update_fields:
+            self.save(update_fields=update_fields)
+        return bool(update_fields)
+
+
+class PrerequisiteGraph:
+    """Course type requirements as bitmasks with one bit per course type."""
+
+    __slots__ = ("index", "requirement_masks")
+
+    def __init__(self, requirements):
+        # requirements maps each course type id to its requirement's id or None
+        self.index = {type_id: i for i, type_id in enumerate(requirements)}
+        self.requirement_masks = [
+            0 if requirement_id is None else 1 << self.index[requirement_id]
+            for requirement_id in requirements.values()
+        ]
+        self._check_acyclic(requirements)
+
+    @staticmethod
+    def _check_acyclic(requirements):
+        acyclic = set()
+        for type_id in requirements:
+            chain = []
+            while type_id is not None and type_id not in acyclic:
+                if type_id in chain:
+                    cycle = chain[chain.index(type_id) :]
+                    raise ValidationError(
+                        "Course type requirements cannot form a cycle "
+                        f"({' -> '.join(str(type_id) for type_id in cycle)})"
+                    )
+                chain.append(type_id)
+                type_id = requirements[type_id]
+            acyclic.update(chain)
+
+    @classmethod
+    def build(cls):
+        return cls(dict(CourseType.objects.values_list("id", "requirement_id")))
+
+    @classmethod
+    def load(cls, type_ids=()):
+        graph = prerequisite_graph_cache.get()
+        # Rebuild if another instance added one of type_ids since it was cached
+        if not all(_course_type_pk(type_id) in graph.index for type_id in type_ids):
+            prerequisite_graph_cache.clear()
+            graph = prerequisite_graph_cache.get()
+        return graph
+
+    def bit(self, type_id):
+        # Ids unknown to the graph, e.g. course types deleted since a cached
+        # snapshot was built, are never taken or eligible
+        i = self.index.get(_course_type_pk(type_id))
+        return 0 if i is None else 1 << i
+
+    def mask(self, type_ids):
+        mask = 0
+        for type_id in type_ids:
+            mask |= self.bit(type_id)
+        return mask
+
+    def requirement_met(self, type_id, mask):
+        i = self.index.get(_course_type_pk(type_id))
+        if i is None:
+            return False
+        return not self.requirement_masks[i] or bool(mask & self.requirement_masks[i])
+
+    def is_eligible(self, type_id, taken_mask):
+        """Not already taken, and its requirement, if any, is in ``taken_mask``."""
+        return not taken_mask & self.bit(type_id) and self.requirement_met(
+            type_id, taken_mask
+        )
+
+    def eligible_ids(self, taken_mask):
+        return [
+            type_id
+            for type_id, i in self.index.items()
+            if not taken_mask & (1 << i)
+            and (
+                not self.requirement_masks[i] or taken_mask & self.requirement_masks[i]
+            )
+        ]
+
+
+def _course_type_pk(type_id):
+    # Ids assigned in Python are not always UUID instances yet
+    return CourseType._meta.pk.to_python(type_id)
+
+
+prerequisite_graph_cache = VersionedCache("catalog", PrerequisiteGraph.build)
+
+
+@receiver(pre_save, sender=CourseType)
+def prevent_requirement_cycles(instance, **kwargs):
+    if instance.requirement_id is None:
+        return
+    requirements = dict(CourseType.objects.values_list("id", "requirement_id"))
+    requirements[_course_type_pk(instance.id)] = _course_type_pk(
+        instance.requirement_id
+    )
+    PrerequisiteGraph(requirements)
+
+
+def _counted(queryset):
+    total = queryset.values("course").annotate(total=Count("pk")).values("total")
+    return Coalesce(Subquery(total), 0)
+
+
+class CourseQuerySet(models.QuerySet):
+    def with_counted_seats(self):
+        """Annotate the seat totals counted from the source tables."""
+        return self.annotate(
+            counted_participants=_counted(
+                Course.participants.through.objects.filter(course=OuterRef("pk"))
+            ),
+            counted_wait_list=_counted(WaitList.objects.filter(course=OuterRef("pk"))),
+        )
+
+    def with_drifted_seats(self):
+        return self.with_counted_seats().exclude(
+            participant_count=F("counted_participants"),
+            wait_list_count=F("counted_wait_list"),
+        )
+
+    def claim_seats(self, seats=1):
+        # One conditional UPDATE, so only the claimed rows are locked
+        return self.filter(participant_count__lte=F("capacity") - seats).update(
+            participant_count=F("participant_count") + seats,
+            seats_changed=timezone.now(),
+        )
+
+    def recount_seats(self):
+        return self.update(
+            seats_changed=timezone.now(),
+            participant_count=_counted(
+                Course.participants.through.objects.filter(course=OuterRef("pk"))
+            ),
+            wait_list_count=_counted(WaitList.objects.filter(course=OuterRef("pk"))),
+        )
+
+    def with_user_state(self, user):
+        """Enrollment flags, wait list entries and dates for ``user``."""
+        enrolled = Course.participants.through.objects.filter(
+            course=OuterRef("pk"), user=user
+        )
+        return self.annotate(user_enrolled=Exists(enrolled)).prefetch_related(
+            "coursedate_set",
+            Prefetch(
+                "waitlist_set",
+                queryset=WaitList.objects.filter(user=user),
+                to_attr="user_wait_list",
+            ),
+        )
+
 
 class Course(BaseModel):
     type = models.ForeignKey(CourseType, on_delete=models.CASCADE)
@@ -168,10 +504,33 @@ class Course(BaseModel):
     participants = models.ManyToManyField(User, blank=True, related_name="participants")
     instructors = models.ManyToManyField(User, blank=True, related_name="instructors")
     shown = models.BooleanField(default=True)
+    participant_count = models.PositiveIntegerField(default=0, editable=False)
+    wait_list_count = models.PositiveIntegerField(default=0, editable=False)
+    seats_changed = models.DateTimeField(auto_now=True)
+
+    objects = CourseQuerySet.as_manager()
+
+    # Maintained with F() updates by the participant and wait list signals,
+    # never by saving an instance that may hold stale values.
+    COUNTER_FIELDS = ("participant_count", "wait_list_count")
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
+        return super().save(*args, **kwargs)
+
+    def claim_seat(self, seats=1):
+        claimed = Course.objects.filter(pk=self.pk).claim_seats(seats) == 1
+        self.refresh_from_db(fields=["participant_count"])
+        return claimed
 
     @property
     def num_of_participants(self):
-        return self.participants.count()
+        return self.participant_count
 
     @property
     def is_full(self):
@@ -183,7 +542,7 @@ class Course(BaseModel):
 
     @property
     def num_on_wait_list(self):
-        return WaitList.objects.filter(course=self).count()
+        return self.wait_list_count
 
     @property
     def start_end_date(self):
@@ -197,7 +556,7 @@ class Course(BaseModel):
         return (
             datetime.datetime.now(tz=datetime.timezone.utc)
             <= course_dates.earliest("start").start
-            - RegistrationSettings.objects.first().refund_period
+            - RegistrationSettings.load().refund_period
         )
 
     @property
@@ -221,32 +580,120 @@ class Course(BaseModel):
         return f"{self.type}/{self.specifics}/{start} - {end}"
 
 
-def added_participant(action, instance, **kwargs):
-    if action == "pre_add":
-        if instance.participants.count() >= instance.capacity:
+def _change_participant_count(instance, reverse, pk_set, change):
+    if reverse:
+        courses = Course.objects.filter(pk__in=pk_set)
+    else:
+        courses = Course.objects.filter(pk=instance.pk)
+        change *= len(pk_set)
+    courses.update(
+        participant_count=F("participant_count") + change,
+        seats_changed=timezone.now(),
+    )
+    if not reverse:
+        instance.refresh_from_db(fields=["participant_count"])
+    return courses
+
+
+@receiver(pre_save, sender=Course)
+def mark_fixture_course(instance, raw, **kwargs):
+    # loaddata sets participants on the course it saved raw, with the seat
+    # counters already restored from the fixture
+    instance._loaded_raw = raw
+
+
+def added_participant(action, instance, reverse, pk_set, **kwargs):
+    if not reverse and getattr(instance, "_loaded_raw", False):
+        return
+    if action == "pre_add" and pk_set:
+        if reverse:
+            courses = Course.objects.filter(pk__in=pk_set)
+            claimed = courses.claim_seats() == len(pk_set)
+        else:
+            courses = [instance]
+            claimed = instance.claim_seat(len(pk_set))
+        if not claimed:
+            names = ", ".join(str(course) for course in courses)
             raise ValidationError(
-                f"There is already too many participants in {instance}, "
+                f"There is already too many participants in {names}, "
                 f"an additional participant cannot be added"
             )
 
-    if action == "post_add":
-        if instance.is_full:
-            CartItem.objects.filter(course=instance).delete()
+    if action == "post_add" and pk_set:
+        if reverse:
+            courses = Course.objects.filter(pk__in=pk_set)
+        else:
+            courses = Course.objects.filter(pk=instance.pk)
+        full_courses = courses.filter(participant_count__gte=F("capacity"))
+        CartItem.objects.filter(course__in=full_courses).delete()
+
+    if action == "post_remove" and pk_set:
+        _change_participant_count(instance, reverse, pk_set, -1)
+
+    if action == "pre_clear" and reverse:
+        instance._cleared_course_ids = set(
+            instance.participants.values_list("pk", flat=True)
+        )
+
+    if action == "post_clear":
+        if reverse:
+            _change_participant_count(instance, True, instance._cleared_course_ids, -1)
+        else:
+            Course.objects.filter(pk=instance.pk).update(
+                participant_count=0, seats_changed=timezone.now()
+            )
+            instance.participant_count = 0
 
 
 m2m_changed.connect(added_participant, sender=Course.participants.through)
 
 
+@receiver(pre_delete, sender=User)
+def release_deleted_participant_seats(instance, **kwargs):
+    # Deleting a user cascades to the participant rows without m2m_changed
+    Course.objects.filter(participants=instance).update(
+        participant_count=F("participant_count") - 1, seats_changed=timezone.now()
+    )
+
+
+class WaitListQuerySet(models.QuerySet):
+    def with_place(self):
+        # Ranks only the rows left by earlier filters, so filter by course only
+        return self.annotate(
+            place=Window(
+                RowNumber(),
+                partition_by=F("course"),
+                order_by=[F("date_added").asc(), F("pk").asc()],
+            )
+        )
+
+    def places(self):
+        return dict(self.with_place().values_list("pk", "place"))
+
+    def for_user(self, user):
+        entries = (
+            self.filter(course__waitlist__user=user)
+            .with_place()
+            .select_related("course__type")
+            .order_by("date_added")
+        )
+        return [entry for entry in entries if entry.user_id == user.id]
+
+
 class WaitList(BaseModel):
     date_added = models.DateTimeField(auto_now_add=True)
     course = models.ForeignKey(Course, models.CASCADE)
     user = models.ForeignKey(User, models.CASCADE)
 
+    objects = WaitListQuerySet.as_manager()
+
     class Meta:
         unique_together = ("course", "user")
 
     @property
     def wait_list_place(self):
+        if hasattr(self, "place"):
+            return self.place
         return WaitList.objects.filter(
             date_added__lte=self.date_added, course=self.course
         ).count()
@@ -261,6 +708,26 @@ def only_allow_wait_list_after_course_is_full(instance, **kwargs):
         )
 
 
+def _change_wait_list_count(wait_list, change):
+    Course.objects.filter(pk=wait_list.course_id).update(
+        wait_list_count=F("wait_list_count") + change,
+        seats_changed=timezone.now(),
+    )
+    if WaitList.course.is_cached(wait_list):
+        wait_list.course.refresh_from_db(fields=["wait_list_count"])
+
+
+@receiver(post_save, sender=WaitList)
+def added_to_wait_list(instance, created, raw, **kwargs):
+    if created and not raw:
+        _change_wait_list_count(instance, 1)
+
+
+@receiver(post_delete, sender=WaitList)
+def removed_from_wait_list(instance, **kwargs):
+    _change_wait_list_count(instance, -1)
+
+
 class WaitListInvoice(BaseModel):
     user = models.ForeignKey(User, models.PROTECT, null=True)
     course = models.ForeignKey(Course, models.PROTECT)
@@ -306,9 +773,45 @@ class PreviousStudentDiscount(BaseModel):
     email = models.EmailField(unique=True)
     discount = models.PositiveIntegerField()
 
+    objects = EmailQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(Lower("email"), name="prevdiscount_email_lower_idx")]
+
+
+class StripeCoupon(BaseModel):
+    coupon_id = models.CharField(max_length=200, unique=True)
+    percent_off = models.PositiveIntegerField(unique=True)
+
+    def __str__(self):
+        return f"{self.percent_off}% off: {self.coupon_id}"
+
+    @classmethod
+    def for_discount(cls, percent_off):
+        """The coupon for ``percent_off``, created in Stripe on first use."""
+        coupon = cls.objects.filter(percent_off=percent_off).first()
+        if coupon is None:
+            stripe_coupon = stripe.Coupon.create(
+                percent_off=percent_off, name="Previous student discount"
+            )
+            coupon, _ = cls.objects.get_or_create(
+                percent_off=percent_off, defaults={"coupon_id": stripe_coupon.id}
+            )
+        return coupon
+
+
+def taken_course_type_ids(user):
+    return set(
+        CourseType.objects.filter(
+            Q(course__cartitem__cart__user=user) | Q(course__participants=user)
+        ).values_list("id", flat=True)
+    )
+
 
 class UserCart(BaseModel):
     user = models.OneToOneField(User, models.CASCADE)
+    # Bumped whenever the user's cart, wait lists or enrollments change
+    state_version = models.PositiveBigIntegerField(default=0, editable=False)
 
     @property
     def num_of_items(self):
@@ -322,9 +825,6 @@ class UserCart(BaseModel):
 
     @property
     def eligible_courses(self):
-        course_types_in_cart_or_signed_up_for = CourseType.objects.filter(
-            Q(course__cartitem__cart=self) | Q(course__participants=self.user)
-        )
         # eligible courses to add to their cart include:
         # 1. Course types with no prerequisites
         # 2. Course types with prerequisites that the user has in their cart
@@ -332,19 +832,15 @@ class UserCart(BaseModel):
         # 4. Course types that they do not already have in their cart
         # 5. Course types they have not already registered for
         #     - This in practice allows a user to only signup for course types once
+        taken_type_ids = taken_course_type_ids(self.user_id)
+        graph = PrerequisiteGraph.load(taken_type_ids)
+        eligible_ids = graph.eligible_ids(graph.mask(taken_type_ids))
         courses = (
             CourseType.objects.all()
             .order_by("name")
             .annotate(
                 eligible=Case(
-                    When(
-                        (
-                            Q(requirement=None)
-                            | Q(requirement__in=course_types_in_cart_or_signed_up_for)
-                        )
-                        & ~Q(id__in=course_types_in_cart_or_signed_up_for),
-                        then=Value(True),
-                    ),
+                    When(id__in=eligible_ids, then=Value(True)),
                     default=Value(False),
                     output_field=models.BooleanField(),
                 )
@@ -352,56 +848,70 @@ class UserCart(BaseModel):
         )
         return courses
 
+    def validate_new_courses(self, courses):
+        """Check ``courses`` can be added together; one may require another."""
+        has_registration_form = RegistrationForm.objects.filter(user=self.user).exists()
+        taken_type_ids = taken_course_type_ids(self.user_id)
+        graph = PrerequisiteGraph.load(
+            taken_type_ids | {course.type_id for course in courses}
+        )
+        taken_mask = graph.mask(taken_type_ids)
+        new_mask = graph.mask(course.type_id for course in courses)
 
-class CartItem(BaseModel):
-    cart = models.ForeignKey(UserCart, models.CASCADE)
-    course = models.ForeignKey(Course, models.CASCADE)
+        for course in courses:
+            if course.is_full:
+                raise ValidationError(
+                    f"A cart item cannot be created with course: {course}, it is full"
+                )
 
+            if not has_registration_form:
+                raise ValidationError(
+                    "A cart item cannot be added until the user fills out a "
+                    "registration form"
+                )
 
-@receiver(pre_save, sender=CartItem)
-def cart_item_validation(instance, **kwargs):
-    if instance.course.is_full:
-        raise ValidationError(
-            f"A cart item cannot be created with course: {instance.course}, it is full"
-        )
+            if taken_mask & graph.bit(course.type_id):
+                raise ValidationError(
+                    "A cart item cannot be added with this course type since the "
+                    "user already has this course type in their cart or they are "
+                    f"already signed up forthis course type ({course.type})"
+                )
+            taken_mask |= graph.bit(course.type_id)
+
+            if not graph.requirement_met(course.type_id, taken_mask | new_mask):
+                requirement = course.type.requirement
+                raise ValidationError(
+                    f"The user does not have the pre_requisite course "
+                    f"({requirement.name}) in their cart or they are not registered "
+                    f"for the course",
+                    requirement,
+                )
 
-    if not RegistrationForm.objects.filter(user=instance.cart.user).exists():
-        raise ValidationError(
-            "A cart item cannot be added until the user fills out a registration form"
+    def add_courses(self, courses):
+        self.validate_new_courses(courses)
+        # bulk_create does not send pre_save, so the courses are validated once,
+        # together
+        cart_items = CartItem.objects.bulk_create(
+            CartItem(cart=self, course=course) for course in courses
         )
+        bump_user_state([self.user_id])
+        return cart_items
 
-    course_types_in_cart_or_signed_up_for = CourseType.objects.filter(
-        Q(course__cartitem__cart=instance.cart)
-        | Q(course__participants=instance.cart.user)
-    )
 
-    if instance.course.type in course_types_in_cart_or_signed_up_for:
-        raise ValidationError(
-            "A cart item cannot be added with this course type since the user already "
-            "has this course type in their cart or they are already signed up for"
-            f"this course type ({instance.course.type})"
-        )
+def bump_user_state(user_ids):
+    UserCart.objects.filter(user__in=user_ids).update(
+        state_version=F("state_version") + 1
+    )
 
 
-@receiver(pre_save, sender=CartItem)
-def verify_requirements(instance, **kwargs):
-    requirement = instance.course.type.requirement
-    if requirement is None:
-        return
+class CartItem(BaseModel):
+    cart = models.ForeignKey(UserCart, models.CASCADE)
+    course = models.ForeignKey(Course, models.CASCADE)
 
-    user_registered_for_requirement = CourseType.objects.filter(
-        course__participants=instance.cart.user
-    ).exists()
-    requirement_in_cart = instance.cart.cartitem_set.filter(
-        course__type=requirement
-    ).exists()
 
-    if not requirement_in_cart and not user_registered_for_requirement:
-        raise ValidationError(
-            f"The user does not have the pre_requisite course ({requirement.name}) "
-            f"in their cart or they are not registered for the course",
-            requirement,
-        )
+@receiver(pre_save, sender=CartItem)
+def cart_item_validation(instance, **kwargs):
+    instance.cart.validate_new_courses([instance.course])
 
 
 @receiver(pre_delete, sender=CartItem)
@@ -413,6 +923,36 @@ def verify_requirements_before_delete(instance, **kwargs):
     cart_items_with_instance_as_requirement.delete()
 
 
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def cart_changed(instance, **kwargs):
+    UserCart.objects.filter(pk=instance.cart_id).update(
+        state_version=F("state_version") + 1
+    )
+
+
+@receiver(post_save, sender=WaitList)
+@receiver(post_delete, sender=WaitList)
+def wait_list_changed(instance, **kwargs):
+    bump_user_state([instance.user_id])
+
+
+def participants_changed(action, instance, reverse, pk_set, **kwargs):
+    if action == "pre_clear" and not reverse:
+        instance._cleared_user_ids = set(
+            instance.participants.values_list("pk", flat=True)
+        )
+
+    if action in ("post_add", "post_remove") and pk_set:
+        bump_user_state([instance.pk] if reverse else pk_set)
+
+    if action == "post_clear":
+        bump_user_state([instance.pk] if reverse else instance._cleared_user_ids)
+
+
+m2m_changed.connect(participants_changed, sender=Course.participants.through)
+
+
 class PaymentRecord(BaseModel):
     user = models.ForeignKey(User, models.PROTECT)
     checkout_session_id = models.CharField(max_length=200, blank=True)
@@ -420,6 +960,32 @@ class PaymentRecord(BaseModel):
     invoice_id = models.CharField(max_length=200, blank=True)
 
 
+class PendingCheckout(BaseModel):
+    """The courses and prices sent to a Stripe checkout session."""
+
+    user = models.ForeignKey(User, models.CASCADE)
+    session_id = models.CharField(max_length=200, blank=True)
+    courses = models.JSONField()
+    coupon_id = models.CharField(max_length=200, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+
+class StripeEvent(BaseModel):
+    """Verified Stripe webhook events waiting to be processed."""
+
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    received = models.DateTimeField(auto_now_add=True)
+    processed = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    claimed_until = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"{self.type}: {self.event_id}"
+
+
 class CourseBought(BaseModel):
     payment_record = models.ForeignKey(PaymentRecord, models.PROTECT)
     course = models.ForeignKey(Course, models.SET_NULL, null=True)
@@ -428,6 +994,7 @@ class CourseBought(BaseModel):
     refunded = models.BooleanField(default=False)
     refund_id = models.CharField(max_length=200, blank=True)
     coupon_id = models.CharField(max_length=200, blank=True)
+    amount_paid = models.PositiveIntegerField(null=True, blank=True)
 
     @property
     def refund_eligible(self):
@@ -435,6 +1002,32 @@ class CourseBought(BaseModel):
             return False
         return self.course.refund_eligble
 
+    @property
+    def unit_price(self):
+        course_type = self.course.type
+        if self.price_id and self.price_id == course_type.stripe_price_id:
+            return course_type.stripe_price_amount
+        return stripe.Price.retrieve(self.price_id)["unit_amount"]
+
+    @property
+    def percent_off(self):
+        if not self.coupon_id:
+            return 0
+        coupon = StripeCoupon.objects.filter(coupon_id=self.coupon_id).first()
+        if coupon is not None:
+            return coupon.percent_off
+        return stripe.Coupon.retrieve(self.coupon_id).percent_off
+
+    @property
+    def purchase_price(self):
+        if self.amount_paid is not None:
+            return self.amount_paid
+        # Purchases fulfilled before the amount was recorded
+        purchase_price = self.unit_price
+        if percent_off := self.percent_off:
+            purchase_price = int(purchase_price * (1 - (percent_off / 100)))
+        return purchase_price
+
 
 def handle_wait_list(course: Course):
     wait_list = WaitList.objects.filter(course=course).order_by("date_added").first()
@@ -445,7 +1038,7 @@ def handle_wait_list(course: Course):
         )
         expiration = (
             datetime.datetime.now(tz=datetime.timezone.utc)
-            + RegistrationSettings.objects.first().time_to_pay_invoice
+            + RegistrationSettings.load().time_to_pay_invoice
         )
         stripe.InvoiceItem.create(
             customer=wait_list.user.profile.stripe_customer_id,
@@ -472,52 +1065,64 @@ def handle_wait_list(course: Course):
     return None
 
 
+PARTICIPANT_FIELDS = (
+    "First Name",
+    "Last Name",
+    "Email",
+    "Address 1",
+    "Address 2",
+    "City",
+    "State",
+    "Zip Code",
+    "Phone 1",
+    "Phone 2",
+    "DOB",
+    "Gender",
+    "Pronouns",
+    "Emergency Contact Name",
+    "Emergency Contact Relationship",
+    "Emergency Contact Phone Number",
+    "Physical Fitness",
+    "Medical Conditions",
+    "Allergies",
+    "Name of Policy Holder",
+    "Relation of Policy Holder",
+)
+PARTICIPANT_VALUES = (
+    "first_name",
+    "last_name",
+    "email",
+    "registrationform__address",
+    "registrationform__address_2",
+    "registrationform__city",
+    "registrationform__state",
+    "registrationform__zip_code",
+    "registrationform__phone_1",
+    "registrationform__phone_2",
+    "registrationform__date_of_birth",
+    "registrationform__gender",
+    "registrationform__pronouns",
+    "registrationform__emergency_contact_name",
+    "registrationform__emergency_contact_relationship_to_you",
+    "registrationform__emergency_contact_phone_number",
+    "registrationform__physical_fitness",
+    "registrationform__medical_condition_description",
+    "registrationform__allergy_condition_description",
+    "registrationform__name_of_policy_holder",
+    "registrationform__relation_of_policy_holder",
+)
+
+
 def get_course_participant_values(course: Course):
-    participants = course.participants
-    fields = (
-        "First Name",
-        "Last Name",
-        "Email",
-        "Address 1",
-        "Address 2",
-        "City",
-        "State",
-        "Zip Code",
-        "Phone 1",
-        "Phone 2",
-        "DOB",
-        "Gender",
-        "Pronouns",
-        "Emergency Contact Name",
-        "Emergency Contact Relationship",
-        "Emergency Contact Phone Number",
-        "Physical Fitness",
-        "Medical Conditions",
-        "Allergies",
-        "Name of Policy Holder",
-        "Relation of Policy Holder",
-    )
-    values = participants.values_list(
-        "first_name",
-        "last_name",
-        "email",
-        "registrationform__address",
-        "registrationform__address_2",
-        "registrationform__city",
-        "registrationform__state",
-        "registrationform__zip_code",
-        "registrationform__phone_1",
-        "registrationform__phone_2",
-        "registrationform__date_of_birth",
-        "registrationform__gender",
-        "registrationform__pronouns",
-        "registrationform__emergency_contact_name",
-        "registrationform__emergency_contact_relationship_to_you",
-        "registrationform__emergency_contact_phone_number",
-        "registrationform__physical_fitness",
-        "registrationform__medical_condition_description",
-        "registrationform__allergy_condition_description",
-        "registrationform__name_of_policy_holder",
-        "registrationform__relation_of_policy_holder",
+    values = course.participants.values_list(*PARTICIPANT_VALUES)
+    return PARTICIPANT_FIELDS, values
+
+
+def get_courses_participant_values(courses):
+    """Participant values for every course, each row prefixed by its course id."""
+    values = (
+        Course.participants.through.objects.filter(course__in=courses)
+        .order_by("course", "user__last_name", "user__first_name")
+        .values_list("course", *(f"user__{value}" for value in PARTICIPANT_VALUES))
     )
-    return fields, values
+    return PARTICIPANT_FIELDS, values
@@ -12,6 +12,11 @@ router.register(
 router.register("cart-item", rest_views.CartItemView, basename="cart_item")
 router.register("wait-list", rest_views.WaitListView, basename="wait_list")
 router.register("cart-cost", rest_views.CartCostView, basename="cart_cost")
+router.register(
+    "seat-availability",
+    rest_views.SeatAvailabilityView,
+    basename="seat_availability",
+)
 
 urlpatterns = [
     path(
@@ -1,41 +1,132 @@
 import datetime
+import hashlib
+import json
+from collections import defaultdict
 
-import stripe
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Max, Prefetch
 from django.http import HttpResponse
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
 from django.views.decorators.csrf import csrf_exempt
-from rest_framework import mixins, permissions, views, viewsets
-from rest_framework.decorators import api_view
+from django.views.decorators.http import condition
+from rest_framework import mixins, permissions, status, views, viewsets
+from rest_framework.decorators import action, api_view
 from rest_framework.response import Response
 
-from registration import models, serializers
+from registration import catalog, models, serializers
 from SkagitRegistration import settings
+from SkagitRegistration.clients import stripe
 
 
+def sign_up_state(request, include):
+    """The ``include`` parts of the sign-up state, as their list endpoints."""
+    state = {}
+    if "eligible_courses" in include:
+        state["eligible_courses"] = catalog.eligible_courses_data(request.user)
+    if "cart" in include:
+        cart = models.UserCart.objects.get(user=request.user)
+        cart_items = cart.cartitem_set.select_related(
+            "course__type__requirement"
+        ).prefetch_related("course__coursedate_set")
+        state["cart"] = {
+            "items": serializers.CartItemListSerializer(cart_items, many=True).data,
+            "cost": cart.cost,
+        }
+    return state
+
+
+class SignUpStateMixin:
+    """Adds the state asked for by ``?include=`` to ``state_actions`` responses."""
+
+    state_actions = ("create", "destroy")
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        include = request.GET.get("include", "").split(",")
+        include = [part for part in include if part in ("eligible_courses", "cart")]
+        if (
+            include
+            and self.action in self.state_actions
+            and status.is_success(response.status_code)
+        ):
+            response.data = {"item": response.data, **sign_up_state(request, include)}
+            if response.status_code == status.HTTP_204_NO_CONTENT:
+                response.status_code = status.HTTP_200_OK
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+def sign_up_state_etag(request, *args, **kwargs):
+    """Changes with the user's cart and courses, the catalog or any seats."""
+    user_version = (
+        models.UserCart.objects.filter(user=request.user)
+        .values_list("state_version", flat=True)
+        .first()
+    )
+    # The snapshot's version, so a new ETag always comes with the new catalog
+    catalog.catalog_cache.get()
+    catalog_version = catalog.catalog_cache.version
+    seats_changed = models.Course.objects.aggregate(Max("seats_changed"))[
+        "seats_changed__max"
+    ]
+    key = (
+        f"{request.user.pk}:{request.get_full_path()}:{user_version}:"
+        f"{catalog_version}:{seats_changed}"
+    )
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+# Browsers keep the response but revalidate it with If-None-Match on every fetch
+sign_up_state_condition = method_decorator(
+    [
+        cache_control(private=True, no_cache=True),
+        condition(etag_func=sign_up_state_etag),
+    ],
+    name="list",
+)
+
+
+@sign_up_state_condition
 class ListEligibleCoursesView(viewsets.ReadOnlyModelViewSet):
     serializer_class = serializers.CourseTypeSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
         user = self.request.user
-        return models.UserCart.objects.get(user=user).eligible_courses.filter(
-            visible=True
+        return (
+            models.UserCart.objects.get(user=user)
+            .eligible_courses.filter(visible=True)
+            .select_related("requirement")
+            .prefetch_related(
+                Prefetch(
+                    "course_set",
+                    queryset=models.Course.objects.with_user_state(user),
+                )
+            )
         )
 
+    def list(self, request, *args, **kwargs):
+        return Response(catalog.eligible_courses_data(request.user))
+
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context["user"] = self.request.user
         return context
 
 
+@sign_up_state_condition
 class CartItemView(
+    SignUpStateMixin,
     mixins.ListModelMixin,
     mixins.DestroyModelMixin,
     mixins.CreateModelMixin,
     viewsets.GenericViewSet,
 ):
     permission_classes = [permissions.IsAuthenticated]
+    state_actions = ("create", "destroy", "bulk")
 
     def get_queryset(self):
         user = self.request.user
@@ -47,11 +138,35 @@ class CartItemView(
     def get_serializer_class(self):
         if self.action == "list":
             return serializers.CartItemListSerializer
+        if self.action == "bulk":
+            return serializers.CartItemBulkSerializer
         return serializers.CartItemSerializer
 
+    @action(detail=False, methods=["post"])
+    def bulk(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        course_ids = serializer.validated_data["courses"]
+        courses = models.Course.objects.select_related("type__requirement").in_bulk(
+            course_ids
+        )
+        if len(courses) != len(set(course_ids)):
+            return Response("Course does not exist", status=404)
+
+        cart = models.UserCart.objects.get(user=request.user)
+        try:
+            cart_items = cart.add_courses([courses[pk] for pk in course_ids])
+        except ValidationError as e:
+            return Response(e.messages, status=400)
+        return Response(
+            serializers.CartItemSerializer(cart_items, many=True).data, status=201
+        )
 
-class CartCostView(mixins.ListModelMixin, viewsets.GenericViewSet):
+
+@sign_up_state_condition
+class CartCostView(SignUpStateMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
     permission_classes = [permissions.IsAuthenticated]
+    state_actions = ("list",)
 
     def list(self, request, *args, **kwargs):
         cart = models.UserCart.objects.get(user=request.user)
@@ -59,7 +174,28 @@ class CartCostView(mixins.ListModelMixin, viewsets.GenericViewSet):
         return Response(serialized_data)
 
 
+class SeatAvailabilityView(mixins.ListModelMixin, viewsets.GenericViewSet):
+    permission_classes = [permissions.IsAuthenticated]
+    # Changes are stamped before they commit, so the returned cursor trails now
+    CHANGE_GRACE_PERIOD = datetime.timedelta(seconds=10)
+
+    def list(self, request, *args, **kwargs):
+        query = serializers.SeatAvailabilityQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        cursor = timezone.now() - self.CHANGE_GRACE_PERIOD
+        courses = models.Course.objects.filter(type__visible=True).only(
+            "capacity", "participant_count", "wait_list_count"
+        )
+        if since := query.validated_data.get("since"):
+            courses = courses.filter(seats_changed__gte=since)
+        serialized_data = serializers.SeatAvailabilitySerializer(
+            courses, many=True
+        ).data
+        return Response({"cursor": cursor, "courses": serialized_data})
+
+
 class WaitListView(
+    SignUpStateMixin,
     mixins.ListModelMixin,
     mixins.DestroyModelMixin,
     mixins.CreateModelMixin,
@@ -72,6 +208,10 @@ class WaitListView(
         user = self.request.user
         return models.WaitList.objects.filter(user=user)
 
+    def list(self, request, *args, **kwargs):
+        wait_list = models.WaitList.objects.for_user(request.user)
+        return Response(self.get_serializer(wait_list, many=True).data)
+
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
@@ -82,50 +222,53 @@ def create_checkout_session(request):
         if not request.user.profile.is_eligible_for_registration:
             return Response("User is not eligible for registration", status=403)
         cart = models.UserCart.objects.get(user=request.user)
-        cart_items = models.CartItem.objects.filter(cart=cart)
+        cart_items = list(
+            models.CartItem.objects.filter(cart=cart).select_related("course__type")
+        )
         discounts = []
         coupon_id = None
-        if pi_discount := models.PreviousStudentDiscount.objects.filter(
-            email=request.user.email
+        if pi_discount := models.PreviousStudentDiscount.objects.with_email(
+            request.user.email
         ).first():
-            coupon = stripe.Coupon.create(
-                percent_off=pi_discount.discount, name="Previous student discount"
-            )
-            discounts.append({"coupon": coupon.stripe_id})
-            coupon_id = coupon.id
-        line_items = []
+            coupon_id = models.StripeCoupon.for_discount(pi_discount.discount).coupon_id
+            discounts.append({"coupon": coupon_id})
+        manifest = []
         for item in cart_items:
-            line_items.append(
+            course_type = item.course.type
+            if not course_type.stripe_price_synced:
+                course_type.sync_stripe_price()
+            manifest.append(
                 {
-                    "price_data": {
-                        "currency": "usd",
-                        "unit_amount": item.course.type.cost,
-                        "product_data": {
-                            "name": item.course.type.name,
-                            "metadata": {
-                                "course_id": item.course.id,
-                                "cart_item_id": item.id,
-                                "coupon_id": coupon_id,
-                            },
-                        },
-                    },
-                    "quantity": 1,
+                    "course_id": str(item.course.id),
+                    "price_id": course_type.stripe_price_id,
                 }
             )
+        # Stripe metadata is too small for a cart's course ids, so keep them here
+        pending_checkout = models.PendingCheckout.objects.create(
+            user=request.user, courses=manifest, coupon_id=coupon_id or ""
+        )
 
         checkout_session = stripe.checkout.Session.create(
             customer=request.user.profile.stripe_customer_id,
+            client_reference_id=str(pending_checkout.id),
             metadata={"user_id": request.user.id},
             payment_method_types=["card"],
-            line_items=line_items,
+            line_items=[
+                {"price": course["price_id"], "quantity": 1} for course in manifest
+            ],
             mode="payment",
             discounts=discounts,
             success_url=request.build_absolute_uri(reverse("registration_home")),
             cancel_url=request.build_absolute_uri(reverse("cart")),
         )
+        pending_checkout.session_id = checkout_session.id
+        pending_checkout.save(update_fields=["session_id"])
         return Response({"id": checkout_session.id})
 
 
+HANDLED_STRIPE_EVENTS = ("checkout.session.completed", "invoice.paid")
+
+
 @csrf_exempt
 def stripe_checkout_webhook(request):
     payload = request.body
@@ -140,25 +283,31 @@ def stripe_checkout_webhook(request):
     except stripe.error.SignatureVerificationError:
         return HttpResponse(status=400)
 
+    if event["type"] in HANDLED_STRIPE_EVENTS:
+        models.StripeEvent.objects.get_or_create(
+            event_id=event["id"],
+            defaults={"type": event["type"], "payload": json.loads(payload)},
+        )
+
+    return HttpResponse(status=200)
+
+
+def process_stripe_event(event):
     if event["type"] == "checkout.session.completed":
         session = event["data"]["object"]
 
-        line_items = stripe.checkout.Session.list_line_items(session.stripe_id)
-        product_ids = [(item.price.product, item.price.id) for item in line_items]
-        courses = []
-        for product_id, price_id in product_ids:
-            product = stripe.Product.retrieve(product_id)
-            course_id = product.metadata.get("course_id")
-            if course_id is None:
-                return HttpResponse(status=204)
-            courses.append(
-                {
-                    "course_id": course_id,
-                    "product_id": product_id,
-                    "price_id": price_id,
-                    "coupon_id": product.metadata.get("coupon_id", ""),
-                }
+        line_items = stripe.checkout.Session.list_line_items(
+            session.stripe_id, limit=100
+        )
+        if session.get("client_reference_id"):
+            pending_checkout = models.PendingCheckout.objects.get(
+                pk=session.client_reference_id
             )
+            courses = checkout_manifest_courses(pending_checkout, line_items)
+        else:
+            courses = checkout_product_courses(line_items)
+        if courses is None:
+            return
 
         fulfill_order(
             courses,
@@ -169,51 +318,114 @@ def stripe_checkout_webhook(request):
 
     elif event["type"] == "invoice.paid":
         invoice = event["data"]["object"]
-        wait_list_invoice = models.WaitListInvoice.objects.get(invoice_id=invoice.id)
-        wait_list_invoice.paid = True
-        wait_list_invoice.save()
-        wait_list_invoice.course.capacity += 1
-        wait_list_invoice.course.save()
-        price = invoice.lines.data[0].price
-        courses = [
+        line = invoice.lines.data[0]
+        with transaction.atomic():
+            wait_list_invoice = models.WaitListInvoice.objects.get(
+                invoice_id=invoice.id
+            )
+            wait_list_invoice.paid = True
+            wait_list_invoice.save()
+            wait_list_invoice.course.capacity += 1
+            wait_list_invoice.course.save()
+            courses = [
+                {
+                    "course_id": wait_list_invoice.course.id,
+                    "product_id": line.price.product,
+                    "price_id": line.price.id,
+                    "coupon_id": "",
+                    "amount_paid": line.amount,
+                }
+            ]
+            fulfill_order(
+                courses,
+                wait_list_invoice.user.id,
+                invoice_id=invoice.id,
+                payment_intent_id=invoice.payment_intent,
+            )
+
+
+def checkout_manifest_courses(pending_checkout, line_items):
+    # Match line items to courses by price rather than by position
+    course_ids = defaultdict(list)
+    for course in pending_checkout.courses:
+        course_ids[course["price_id"]].append(course["course_id"])
+    courses = []
+    for item in line_items.data:
+        if not course_ids[item.price.id]:
+            raise ValueError(
+                f"Checkout {pending_checkout.session_id} has a line item for "
+                f"{item.price.id} that matches none of its courses"
+            )
+        courses.append(
             {
-                "course_id": wait_list_invoice.course.id,
-                "product_id": price.product,
-                "price_id": price.id,
-                "coupon_id": "",
+                "course_id": course_ids[item.price.id].pop(),
+                "product_id": item.price.product,
+                "price_id": item.price.id,
+                "coupon_id": pending_checkout.coupon_id,
+                "amount_paid": item.amount_total,
             }
-        ]
-        fulfill_order(
-            courses,
-            wait_list_invoice.user.id,
-            invoice_id=invoice.id,
-            payment_intent_id=invoice.payment_intent,
         )
-
-    return HttpResponse(status=200)
+    if len(courses) != len(pending_checkout.courses):
+        raise ValueError(
+            f"Checkout {pending_checkout.session_id} has {len(courses)} line items "
+            f"but {len(pending_checkout.courses)} courses"
+        )
+    return courses
+
+
+def checkout_product_courses(line_items):
+    # Sessions created before the manifest existed
+    courses = []
+    for item in line_items.data:
+        product = stripe.Product.retrieve(item.price.product)
+        course_id = product.metadata.get("course_id")
+        if course_id is None:
+            return None
+        courses.append(
+            {
+                "course_id": course_id,
+                "product_id": item.price.product,
+                "price_id": item.price.id,
+                "coupon_id": product.metadata.get("coupon_id", ""),
+                "amount_paid": item.amount_total,
+            }
+        )
+    return courses
 
 
 def fulfill_order(
     courses, user_id, checkout_session_id="", invoice_id="", payment_intent_id=""
 ):
     user = User.objects.get(id=user_id)
-    cart = models.UserCart.objects.get(user=user)
-    models.CartItem.objects.filter(cart=cart).delete()
-    payment_record = models.PaymentRecord.objects.create(
-        user=user,
-        checkout_session_id=checkout_session_id,
-        payment_intent_id=payment_intent_id,
-        invoice_id=invoice_id,
-    )
-    for course_data in courses:
-        course = models.Course.objects.get(id=course_data["course_id"])
-        course.participants.add(user)
-        models.CourseBought.objects.create(
-            payment_record=payment_record,
-            course=course,
-            product_id=course_data["product_id"],
-            price_id=course_data["price_id"],
-            coupon_id=course_data["coupon_id"],
+    with transaction.atomic():
+        course_ids = [course_data["course_id"] for course_data in courses]
+        bought = models.Course.objects.in_bulk(course_ids)
+        missing = set(map(str, course_ids)) - set(map(str, bought))
+        if missing:
+            raise models.Course.DoesNotExist(
+                f"Courses {', '.join(sorted(missing))} do not exist"
+            )
+
+        models.CartItem.objects.filter(cart__user=user).delete()
+        payment_record = models.PaymentRecord.objects.create(
+            user=user,
+            checkout_session_id=checkout_session_id,
+            payment_intent_id=payment_intent_id,
+            invoice_id=invoice_id,
+        )
+        # Claims every seat with one UPDATE and inserts the participant rows in
+        # bulk, raising if any course has filled up since checkout
+        user.participants.add(*bought.values())
+        models.CourseBought.objects.bulk_create(
+            models.CourseBought(
+                payment_record=payment_record,
+                course_id=course_data["course_id"],
+                product_id=course_data["product_id"],
+                price_id=course_data["price_id"],
+                coupon_id=course_data["coupon_id"],
+                amount_paid=course_data.get("amount_paid"),
+            )
+            for course_data in courses
         )
 
 
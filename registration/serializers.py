@@ -9,12 +9,30 @@ class CourseDateSerializer(serializers.ModelSerializer):
         fields = ["name", "start", "end"]
 
 
-class WaitListSerializer(serializers.ModelSerializer):
+class UserWaitListSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.WaitList
         fields = ["id", "course"]
 
 
+class WaitListSerializer(serializers.ModelSerializer):
+    place = serializers.IntegerField(source="wait_list_place", read_only=True)
+
+    class Meta:
+        model = models.WaitList
+        fields = ["id", "course", "place"]
+
+
+class SeatAvailabilitySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.Course
+        fields = ["id", "spots_left", "is_full", "num_on_wait_list"]
+
+
+class SeatAvailabilityQuerySerializer(serializers.Serializer):
+    since = serializers.DateTimeField(required=False)
+
+
 class CourseSerializer(serializers.ModelSerializer):
     coursedate_set = CourseDateSerializer(many=True)
     user_on_wait_list = serializers.SerializerMethodField("_user_on_wait_list")
@@ -34,10 +52,15 @@ class CourseSerializer(serializers.ModelSerializer):
         ]
 
     def _user_on_wait_list(self, obj):
+        if hasattr(obj, "user_wait_list"):
+            wait_list = obj.user_wait_list[0] if obj.user_wait_list else None
+            return UserWaitListSerializer(wait_list).data
         user = self.context.get("user")
-        return WaitListSerializer(obj.user_on_wait_list(user)).data
+        return UserWaitListSerializer(obj.user_on_wait_list(user)).data
 
     def _user_enrolled(self, obj):
+        if hasattr(obj, "user_enrolled"):
+            return obj.user_enrolled
         user = self.context.get("user")
         return models.CourseType.objects.filter(
             course__participants=user, course=obj
@@ -93,6 +116,10 @@ class CartItemSerializer(serializers.ModelSerializer):
         fields = ["id", "course"]
 
 
+class CartItemBulkSerializer(serializers.Serializer):
+    courses = serializers.ListField(child=serializers.UUIDField(), allow_empty=False)
+
+
 class CartItemListSerializer(CartItemSerializer):
     course = CartCourseSerializer()
 
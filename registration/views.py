@@ -1,6 +1,6 @@
-import stripe
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db import transaction
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse_lazy
 from django.views.generic import FormView, TemplateView
@@ -8,6 +8,7 @@ from django.views.generic import FormView, TemplateView
 from registration import models
 from registration.forms import RegistrationForm
 from SkagitRegistration import settings
+from SkagitRegistration.clients import stripe
 
 
 class ProfileView(LoginRequiredMixin, TemplateView):
@@ -42,7 +43,7 @@ class RegistrationHome(LoginRequiredMixin, TemplateView):
         context["registration_complete"] = models.RegistrationForm.objects.filter(
             user=self.request.user
         ).exists()
-        context["registration_settings"] = models.RegistrationSettings.objects.first()
+        context["registration_settings"] = models.RegistrationSettings.load()
         context["user_courses"] = models.Course.objects.filter(
             participants=self.request.user
         )
@@ -67,16 +68,10 @@ def refund(request, course_pk):
     context = {"refund_eligible": refund_eligible, "course": course_bought.course}
 
     if refund_eligible:
-        purchase_price = stripe.Price.retrieve(course_bought.price_id)["unit_amount"]
-        if course_bought.coupon_id:
-            percent_off = stripe.Coupon.retrieve(course_bought.coupon_id).percent_off
-            purchase_price *= 1 - (percent_off / 100)
-            purchase_price = int(purchase_price)
-
+        purchase_price = course_bought.purchase_price
         context["purchase_price"] = models.human_readable_cost(purchase_price)
         refund_amount = (
-            purchase_price
-            - models.RegistrationSettings.objects.first().cancellation_fee
+            purchase_price - models.RegistrationSettings.load().cancellation_fee
         )
         context["refund_amount"] = models.human_readable_cost(refund_amount)
 
@@ -86,13 +81,18 @@ def refund(request, course_pk):
                 idempotency_key=str(course_bought.id),
                 amount=refund_amount,
             )
-            course_bought.refund_id = refund["id"]
-            course_bought.refunded = True
-            course_bought.save()
-            course.participants.remove(request.user)
-            if course.num_on_wait_list > 0:
-                course.capacity -= 1
-                course.save()
+            with transaction.atomic():
+                course_bought.refund_id = refund["id"]
+                course_bought.refunded = True
+                course_bought.save()
+                course.participants.remove(request.user)
+                offer_seat = course.num_on_wait_list > 0
+                if offer_seat:
+                    course.capacity -= 1
+                    course.save()
+            # handle_wait_list calls Stripe, so it runs once the course row
+            # lock taken by the remove is released
+            if offer_seat:
                 models.handle_wait_list(course)
             return redirect("registration_home")
 
@@ -136,11 +136,11 @@ class CartView(LoginRequiredMixin, TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["registration_settings"] = models.RegistrationSettings.objects.first()
+        context["registration_settings"] = models.RegistrationSettings.load()
         context["stripe_public_api_key"] = settings.STRIPE_PUBLIC_API_KEY
         context["eligible_previous_student_discount"] = (
-            models.PreviousStudentDiscount.objects.filter(
-                email=self.request.user.email
+            models.PreviousStudentDiscount.objects.with_email(
+                self.request.user.email
             ).exists()
         )
         return context
@@ -4,7 +4,7 @@ import pytest
 from faker import Faker
 from model_bakery import baker
 
-from registration import models
+from registration import catalog, models
 
 
 @pytest.fixture
@@ -26,6 +26,13 @@ def patch_stripe(monkeypatch):
     monkeypatch.setattr("stripe.Customer.create", create_customer)
 
 
+@pytest.fixture(autouse=True)
+def clear_process_caches():
+    models.registration_settings_cache.clear()
+    catalog.catalog_cache.clear()
+    models.prerequisite_graph_cache.clear()
+
+
 @pytest.fixture
 def registration_settings():
     baker.make(
@@ -0,0 +1,75 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from django.core.management import CommandError, call_command
+
+from registration.management.commands import benchmark_cold_start
+from SkagitRegistration import clients
+
+IMPORTTIME_OUTPUT = """\
+import time: self [us] | cumulative | imported package
+import time:      1000 |       1000 |     django.utils
+import time:      2000 |       3000 |   django
+import time:       500 |        500 |   stripe
+import time:       250 |        250 | encodings
+Loaded secrets from file in 0.1 ms
+"""
+
+
+def test_parse_import_times():
+    import_times = benchmark_cold_start.parse_import_times(IMPORTTIME_OUTPUT)
+    assert import_times["django"] == pytest.approx(0.003)
+    assert import_times["stripe"] == pytest.approx(0.0005)
+    assert import_times["encodings"] == pytest.approx(0.00025)
+
+
+def test_benchmark_cold_start_budget(monkeypatch):
+    timings = {
+        "status_code": 200,
+        "import_seconds": 0.4,
+        "first_request_seconds": 0.2,
+        "warm_request_seconds": 0.01,
+    }
+
+    def run(args, **kwargs):
+        assert "SkagitRegistration.cold_start_probe" in args
+        return subprocess.CompletedProcess(
+            args, 0, stdout=json.dumps(timings) + "\n", stderr=IMPORTTIME_OUTPUT
+        )
+
+    monkeypatch.setattr(subprocess, "run", run)
+    call_command("benchmark_cold_start", budget=700)
+    with pytest.raises(CommandError, match="over the budget"):
+        call_command("benchmark_cold_start", budget=500)
+
+
+def test_handler_import_does_not_load_client_modules(settings):
+    probe = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, SkagitRegistration.asgi, registration.rest_views, "
+            "registration.views; "
+            "print(','.join(m for m in ('stripe', 'boto3') if m in sys.modules))",
+        ],
+        capture_output=True,
+        text=True,
+        cwd=settings.BASE_DIR,
+        env={**os.environ, "DJANGO_SETTINGS_MODULE": settings.SETTINGS_MODULE},
+    )
+    assert probe.returncode == 0, probe.stderr
+    assert probe.stdout.strip() == ""
+
+
+def test_lazy_stripe_is_configured_on_first_use(monkeypatch, settings):
+    import stripe
+
+    monkeypatch.setattr(stripe, "api_key", None)
+    settings.STRIPE_API_KEY = "sk_test_lazy"
+    lazy_stripe = clients.LazyModule("stripe", configure=clients._configure_stripe)
+    assert not lazy_stripe.is_loaded
+    assert lazy_stripe.Price is stripe.Price
+    assert stripe.api_key == "sk_test_lazy"
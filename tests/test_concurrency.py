@@ -0,0 +1,71 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import connection
+from model_bakery import baker
+
+from registration import models, rest_views
+
+pytestmark = [
+    pytest.mark.django_db(transaction=True),
+    pytest.mark.skipif(
+        connection.vendor != "postgresql",
+        reason="seat claim concurrency needs row locking from Postgres",
+    ),
+]
+
+FULFILLMENTS = 300
+WORKERS = 50
+
+
+def _fulfill_concurrently(orders):
+    def fulfill(order):
+        course, user = order
+        course_data = {
+            "course_id": course.id,
+            "product_id": "",
+            "price_id": "",
+            "coupon_id": "",
+        }
+        try:
+            rest_views.fulfill_order([course_data], user.id)
+            return True
+        except ValidationError:
+            return False
+        finally:
+            connection.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        results = list(executor.map(fulfill, orders))
+    elapsed = time.perf_counter() - start
+    print(
+        f"{len(orders)} fulfillments with {WORKERS} workers: {elapsed:.2f}s "
+        f"({len(orders) / elapsed:.0f}/s)"
+    )
+    return results
+
+
+def test_concurrent_fulfillments_never_oversubscribe():
+    course = baker.make(models.Course, capacity=100)
+    users = baker.make(User, _quantity=FULFILLMENTS)
+
+    results = _fulfill_concurrently([(course, user) for user in users])
+
+    course.refresh_from_db()
+    assert sum(results) == 100
+    assert course.participant_count == 100
+    assert course.participants.count() == 100
+
+
+def test_concurrent_fulfillments_for_different_courses():
+    courses = baker.make(models.Course, capacity=1, _quantity=FULFILLMENTS)
+    users = baker.make(User, _quantity=FULFILLMENTS)
+
+    results = _fulfill_concurrently(list(zip(courses, users)))
+
+    assert all(results)
+    assert not models.Course.objects.filter(participant_count__gt=1).exists()
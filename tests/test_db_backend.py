@@ -0,0 +1,87 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+from django.core.signals import request_finished
+from django.db import connections
+
+from SkagitRegistration.db import base
+
+
+def _serve_requests(count):
+    """The raw connection used by each of ``count`` requests in new threads."""
+    used = []
+
+    def request():
+        connection = connections["default"]
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        used.append(connection.connection)
+        request_finished.send(sender=None)
+
+    try:
+        for _ in range(count):
+            thread = threading.Thread(target=request)
+            thread.start()
+            thread.join()
+    finally:
+        base.close_idle_connections()
+    return used
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize("health_checks", [False, True])
+def test_persistent_connections_are_reused_across_requests(monkeypatch, health_checks):
+    monkeypatch.setitem(connections.settings["default"], "CONN_MAX_AGE", 60)
+    monkeypatch.setitem(
+        connections.settings["default"], "CONN_HEALTH_CHECKS", health_checks
+    )
+    reused = base.connection_stats["reused"]
+
+    first, second, third = _serve_requests(3)
+    assert first is second is third
+    assert base.connection_stats["reused"] == reused + 2
+
+
+@pytest.mark.django_db(transaction=True)
+def test_connections_close_without_max_age(monkeypatch):
+    monkeypatch.setitem(connections.settings["default"], "CONN_MAX_AGE", 0)
+    opened = base.connection_stats["opened"]
+
+    first, second = _serve_requests(2)
+    assert first is not second
+    assert first.closed
+    assert base.connection_stats["opened"] == opened + 2
+
+
+@pytest.mark.parametrize(
+    "database_url, engine",
+    [
+        ("postgres://user@localhost/bmc", "SkagitRegistration.db"),
+        ("sqlite:///bmc.sqlite3", "django.db.backends.sqlite3"),
+    ],
+)
+def test_lambda_backend_only_replaces_postgres(
+    settings, tmp_path, database_url, engine
+):
+    secrets_file = tmp_path / "secrets.json"
+    secrets_file.write_text(
+        json.dumps({"DATABASE_URL": database_url, "ALLOWED_HOSTS": "localhost"})
+    )
+    probe = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "from SkagitRegistration import settings; "
+            "print(settings.DATABASES['default']['ENGINE'])",
+        ],
+        capture_output=True,
+        text=True,
+        cwd=settings.BASE_DIR,
+        env={**os.environ, "ENV_SECRETS_FILE": str(secrets_file)},
+    )
+    assert probe.returncode == 0, probe.stderr
+    assert probe.stdout.strip() == engine
@@ -0,0 +1,105 @@
+import json
+import os
+import stat
+
+import pytest
+
+from SkagitRegistration import env_secrets
+
+
+@pytest.fixture
+def isolated_environ(monkeypatch, tmp_path):
+    monkeypatch.setattr(os, "environ", dict(os.environ))
+    monkeypatch.delenv("ENV_SECRETS_FILE", raising=False)
+    monkeypatch.setenv("AWS_SECRETS_CONFIG_NAME", "test-secrets")
+    monkeypatch.setattr("tempfile.gettempdir", lambda: str(tmp_path))
+
+
+def test_load_env_secrets_from_file(isolated_environ, monkeypatch, tmp_path):
+    secrets_file = tmp_path / "secrets.json"
+    secrets_file.write_text(json.dumps({"DJANGO_SECRET_KEY": "from-file"}))
+    monkeypatch.setenv("ENV_SECRETS_FILE", str(secrets_file))
+    monkeypatch.setattr(env_secrets, "_fetch_secrets", pytest.fail)
+
+    assert env_secrets.load_env_secrets().source == "file"
+    assert os.environ["DJANGO_SECRET_KEY"] == "from-file"
+
+
+@pytest.fixture
+def fetched(monkeypatch):
+    fetched = []
+
+    def fetch_secrets(secrets_id):
+        fetched.append(secrets_id)
+        return {"DJANGO_SECRET_KEY": "from-aws"}
+
+    monkeypatch.setattr(env_secrets, "_fetch_secrets", fetch_secrets)
+    return fetched
+
+
+def test_load_env_secrets_does_not_cache_by_default(isolated_environ, fetched):
+    assert env_secrets.load_env_secrets().source == "secretsmanager"
+    assert env_secrets.load_env_secrets().source == "secretsmanager"
+    assert fetched == ["test-secrets", "test-secrets"]
+
+
+def test_load_env_secrets_caches_secrets_manager(
+    isolated_environ, monkeypatch, fetched
+):
+    monkeypatch.setenv("ENV_SECRETS_CACHE_SECONDS", "900")
+
+    assert env_secrets.load_env_secrets().source == "secretsmanager"
+    assert env_secrets.load_env_secrets().source == "cache"
+    assert fetched == ["test-secrets"]
+    assert os.environ["DJANGO_SECRET_KEY"] == "from-aws"
+
+    monkeypatch.setenv("ENV_SECRETS_CACHE_SECONDS", "-1")
+    assert env_secrets.load_env_secrets().source == "secretsmanager"
+    assert len(fetched) == 2
+
+
+def _cache_file(tmp_path):
+    (cache_file,) = (tmp_path / "env-secrets").iterdir()
+    return cache_file
+
+
+@pytest.mark.parametrize("mode", [0o644, 0o604])
+def test_load_env_secrets_ignores_readable_cache(
+    isolated_environ, monkeypatch, fetched, tmp_path, mode
+):
+    monkeypatch.setenv("ENV_SECRETS_CACHE_SECONDS", "900")
+    env_secrets.load_env_secrets()
+    assert stat.S_IMODE(os.stat(tmp_path / "env-secrets").st_mode) == 0o700
+    assert stat.S_IMODE(os.stat(_cache_file(tmp_path)).st_mode) == 0o600
+
+    _cache_file(tmp_path).chmod(mode)
+    assert env_secrets.load_env_secrets().source == "secretsmanager"
+
+
+def test_load_env_secrets_ignores_foreign_cache(
+    isolated_environ, monkeypatch, fetched, tmp_path
+):
+    monkeypatch.setenv("ENV_SECRETS_CACHE_SECONDS", "900")
+    env_secrets.load_env_secrets()
+
+    uid = os.getuid()
+    monkeypatch.setattr(os, "getuid", lambda: uid + 1)
+    assert env_secrets.load_env_secrets().source == "secretsmanager"
+
+
+def test_load_env_secrets_ignores_planted_cache(
+    isolated_environ, monkeypatch, fetched, tmp_path
+):
+    monkeypatch.setenv("ENV_SECRETS_CACHE_SECONDS", "900")
+    env_secrets.load_env_secrets()
+    cache_file = _cache_file(tmp_path)
+    planted = tmp_path / "planted.json"
+    planted.write_text(json.dumps({"DATABASE_URL": "postgres://attacker"}))
+    planted.chmod(0o600)
+    cache_file.unlink()
+    cache_file.symlink_to(planted)
+
+    assert env_secrets.load_env_secrets().source == "secretsmanager"
+    assert os.environ.get("DATABASE_URL") != "postgres://attacker"
+    assert not cache_file.is_symlink()
+    assert planted.read_text() == json.dumps({"DATABASE_URL": "postgres://attacker"})
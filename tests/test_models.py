@@ -1,8 +1,12 @@
+import random
 from datetime import datetime, timezone
 
 import pytest
+import stripe
 from django.contrib.auth.models import Group, User
 from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db.models import Q
 from model_bakery import baker
 
 from registration import models
@@ -15,9 +19,34 @@ def test_is_eligible_for_early_registration():
     user = baker.make(User, email="user@test.com")
     assert not user.profile.is_eligible_for_early_registration
     baker.make(models.EarlySignupEmail, email=user.email)
+    user.profile.refresh_from_db()
     assert user.profile.is_eligible_for_early_registration
 
 
+def test_early_registration_eligibility_is_maintained(create_registration_form):
+    user = baker.make(User, email="User@Test.com")
+    early_signup_email = baker.make(models.EarlySignupEmail, email="user@test.COM")
+    assert models.Profile.objects.get(user=user).is_eligible_for_early_registration
+
+    early_signup_email.email = "someone@else.com"
+    early_signup_email.save()
+    assert not models.Profile.objects.get(user=user).early_registration_eligible
+
+    registration_form = create_registration_form(user)
+    registration_form.skagit_county_resident = True
+    registration_form.save()
+    assert models.Profile.objects.get(user=user).early_registration_eligible
+
+    registration_form.skagit_county_resident = False
+    registration_form.save()
+    user.email = "someone@else.com"
+    user.save()
+    assert models.Profile.objects.get(user=user).early_registration_eligible
+
+    early_signup_email.delete()
+    assert not models.Profile.objects.get(user=user).early_registration_eligible
+
+
 @pytest.mark.parametrize(
     ["date", "normal", "early_signup"],
     (
@@ -31,6 +60,7 @@ def test_is_eligible_for_registration(freezer, date, normal, early_signup):
     user1 = baker.make(User, email="user1@gmail.com")
     user2 = baker.make(User, email="user2@gmail.com")
     baker.make(models.EarlySignupEmail, email=user2.email)
+    user2.profile.refresh_from_db()
     baker.make(
         models.RegistrationSettings,
         early_registration_open=datetime(2021, 1, 10),
@@ -363,3 +393,282 @@ def test_course_bought_refund_eligible(freezer, registration_settings):
     course_bought.refunded = True
     course_bought.save()
     assert not course_bought.refund_eligible
+
+
+def test_course_seat_counters_follow_participant_changes():
+    course = baker.make(models.Course, capacity=10)
+    users = baker.make(User, _quantity=3)
+    course.participants.add(*users)
+    assert course.participant_count == 3
+
+    users[0].participants.add(baker.make(models.Course, capacity=10))
+    users[1].participants.remove(course)
+    course.refresh_from_db()
+    assert course.participant_count == 2
+
+    course.participants.clear()
+    assert course.participant_count == 0
+    assert models.Course.objects.get(pk=course.pk).participant_count == 0
+
+
+def test_deleting_participant_releases_seat():
+    course = baker.make(models.Course, capacity=1)
+    user = baker.make(User)
+    course.participants.add(user)
+    baker.make(models.WaitList, course=course, user=user)
+
+    user.delete()
+    course.refresh_from_db()
+    assert course.participant_count == 0
+    assert course.wait_list_count == 0
+    assert course.claim_seat()
+
+
+def test_course_wait_list_counter():
+    course = baker.make(models.Course, capacity=0)
+    wait_list = baker.make(models.WaitList, course=course, _quantity=3)
+    wait_list[0].delete()
+    models.WaitList.objects.filter(pk=wait_list[1].pk).delete()
+    course.refresh_from_db()
+    assert course.num_on_wait_list == 1
+
+
+def test_course_save_does_not_overwrite_seat_counters():
+    course = baker.make(models.Course, capacity=10)
+    stale_course = models.Course.objects.get(pk=course.pk)
+    course.participants.add(baker.make(User))
+    stale_course.capacity = 12
+    stale_course.save()
+    course.refresh_from_db()
+    assert course.capacity == 12
+    assert course.participant_count == 1
+
+
+def test_seat_counters_survive_fixture_round_trip(tmp_path):
+    course = baker.make(models.Course, capacity=4)
+    course.participants.add(*baker.make(User, _quantity=3))
+    baker.make(models.WaitList, course=baker.make(models.Course, capacity=0))
+    fixture = tmp_path / "courses.json"
+    call_command(
+        "dumpdata", "registration.course", "registration.waitlist", output=fixture
+    )
+    models.Course.participants.through.objects.all().delete()
+    models.WaitList.objects.all().delete()
+
+    call_command("loaddata", fixture)
+    assert not models.Course.objects.with_drifted_seats().exists()
+    course.refresh_from_db()
+    assert course.participant_count == 3
+    assert course.claim_seat()
+
+
+def test_sync_seat_counts():
+    course = baker.make(models.Course, capacity=10)
+    course.participants.add(*baker.make(User, _quantity=2))
+    models.Course.objects.filter(pk=course.pk).update(participant_count=7)
+
+    with pytest.raises(CommandError):
+        call_command("sync_seat_counts", "--verify")
+    call_command("sync_seat_counts")
+    call_command("sync_seat_counts", "--verify")
+    course.refresh_from_db()
+    assert course.participant_count == 2
+
+
+def test_wait_list_places_ranked_per_course():
+    course = baker.make(models.Course, capacity=0)
+    course2 = baker.make(models.Course, capacity=0)
+    user = baker.make(User)
+    baker.make(models.WaitList, course=course2, _quantity=2)
+    baker.make(models.WaitList, course=course, _quantity=3)
+    course_entry = baker.make(models.WaitList, course=course, user=user)
+    course2_entry = baker.make(models.WaitList, course=course2, user=user)
+
+    places = models.WaitList.objects.places()
+    for wait_list in models.WaitList.objects.all():
+        assert places[wait_list.pk] == wait_list.wait_list_place
+
+    user_entries = models.WaitList.objects.for_user(user)
+    assert [entry.pk for entry in user_entries] == [course_entry.pk, course2_entry.pk]
+    assert [entry.wait_list_place for entry in user_entries] == [4, 3]
+
+
+def test_registration_settings_load_is_cached(
+    settings, django_assert_num_queries, registration_settings
+):
+    settings.CACHE_VERSION_CHECK_SECONDS = 60
+    loaded = models.RegistrationSettings.load()
+    with django_assert_num_queries(0):
+        assert models.RegistrationSettings.load() is loaded
+
+    loaded.cancellation_fee = 500
+    loaded.save()
+    assert models.RegistrationSettings.load().cancellation_fee == 500
+
+
+def test_registration_settings_load_sees_other_instances_changes(
+    settings, registration_settings
+):
+    settings.CACHE_VERSION_CHECK_SECONDS = 60
+    loaded = models.RegistrationSettings.load()
+
+    # Another Lambda instance saving the settings only bumps the version row
+    models.RegistrationSettings.objects.update(cancellation_fee=700)
+    models.CacheVersion.bump("registration_settings")
+    assert models.RegistrationSettings.load() is loaded
+
+    models.registration_settings_cache.next_check = 0.0
+    assert models.RegistrationSettings.load().cancellation_fee == 700
+
+
+def test_course_type_sync_stripe_price(monkeypatch):
+    created_prices = []
+    deactivated = []
+
+    def create_price(**kwargs):
+        created_prices.append(kwargs)
+        return stripe.Price.construct_from({"id": f"price_{len(created_prices)}"}, "")
+
+    monkeypatch.setattr(
+        "stripe.Product.create",
+        lambda **kwargs: stripe.Product.construct_from({"id": "prod_1"}, ""),
+    )
+    monkeypatch.setattr("stripe.Price.create", create_price)
+    monkeypatch.setattr(
+        "stripe.Price.modify", lambda price_id, **kwargs: deactivated.append(price_id)
+    )
+    course_type = baker.make(models.CourseType, cost=10000)
+    assert not course_type.stripe_price_synced
+
+    assert course_type.sync_stripe_price()
+    catalog_version = models.CacheVersion.current("catalog")
+    assert not course_type.sync_stripe_price()
+    assert models.CacheVersion.current("catalog") == catalog_version
+    course_type.refresh_from_db()
+    assert course_type.stripe_product_id == "prod_1"
+    assert course_type.stripe_price_id == "price_1"
+    assert len(created_prices) == 1
+
+    course_type.cost = 12000
+    course_type.save()
+    course_type.sync_stripe_price()
+    assert course_type.stripe_price_id == "price_2"
+    assert created_prices[-1]["unit_amount"] == 12000
+    assert deactivated == ["price_1"]
+
+
+def test_sync_stripe_catalog_only_renames_changed_products(monkeypatch):
+    renamed = []
+    monkeypatch.setattr(
+        "stripe.Product.retrieve",
+        lambda product_id: stripe.Product.construct_from(
+            {"id": product_id, "name": "Rock"}, ""
+        ),
+    )
+    monkeypatch.setattr(
+        "stripe.Product.modify",
+        lambda product_id, **kwargs: renamed.append((product_id, kwargs["name"])),
+    )
+    for name in ("Rock", "Rock 1"):
+        baker.make(
+            models.CourseType,
+            name=name,
+            cost=10000,
+            stripe_product_id=f"prod_{name}",
+            stripe_price_id="price_1",
+            stripe_price_amount=10000,
+        )
+    catalog_version = models.CacheVersion.current("catalog")
+
+    call_command("sync_stripe_catalog")
+    assert renamed == [("prod_Rock 1", "Rock 1")]
+    assert models.CacheVersion.current("catalog") == catalog_version
+
+
+def test_stripe_coupon_reused_per_discount(monkeypatch):
+    created = []
+
+    def create_coupon(**kwargs):
+        created.append(kwargs)
+        return stripe.Coupon.construct_from({"id": f"coupon_{len(created)}"}, "")
+
+    monkeypatch.setattr("stripe.Coupon.create", create_coupon)
+    monkeypatch.setattr(
+        "stripe.Coupon.retrieve",
+        lambda coupon_id: pytest.fail("Local coupons should not be retrieved"),
+    )
+    first = models.StripeCoupon.for_discount(10)
+    assert models.StripeCoupon.for_discount(10) == first
+    assert models.StripeCoupon.for_discount(20).coupon_id == "coupon_2"
+    assert [kwargs["percent_off"] for kwargs in created] == [10, 20]
+
+    course_bought = baker.prepare(models.CourseBought, coupon_id=first.coupon_id)
+    assert course_bought.percent_off == 10
+    assert baker.prepare(models.CourseBought, coupon_id="").percent_off == 0
+
+
+def test_prerequisite_graph_rejects_cycles():
+    first = baker.make(models.CourseType)
+    second = baker.make(models.CourseType, requirement=first)
+    third = baker.make(models.CourseType, requirement=second)
+
+    first.requirement = third
+    with pytest.raises(ValidationError) as e:
+        first.save()
+    assert "cycle" in str(e.value)
+
+    first.requirement = first
+    with pytest.raises(ValidationError):
+        first.save()
+
+    with pytest.raises(ValidationError):
+        models.PrerequisiteGraph({1: 2, 2: 3, 3: 1, 4: None})
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_prerequisite_graph_agrees_with_query_eligibility(
+    seed, create_registration_form
+):
+    rng = random.Random(seed)
+    course_types = []
+    for _ in range(12):
+        requirement = rng.choice([None, None, *course_types])
+        course_types.append(baker.make(models.CourseType, requirement=requirement))
+    user = baker.make(User)
+    create_registration_form(user)
+    cart = user.usercart
+    for course_type in rng.sample(course_types, 5):
+        course = baker.make(models.Course, type=course_type, capacity=5)
+        if rng.random() < 0.5:
+            course.participants.add(user)
+        else:
+            models.CartItem.objects.bulk_create(
+                [models.CartItem(cart=cart, course=course)]
+            )
+
+    taken = models.CourseType.objects.filter(
+        Q(course__cartitem__cart=cart) | Q(course__participants=user)
+    )
+    query_eligible = set(
+        models.CourseType.objects.filter(
+            (Q(requirement=None) | Q(requirement__in=taken)) & ~Q(id__in=taken)
+        ).values_list("id", flat=True)
+    )
+    assert (
+        set(cart.eligible_courses.filter(eligible=True).values_list("id", flat=True))
+        == query_eligible
+    )
+
+    graph = models.PrerequisiteGraph.load()
+    taken_mask = graph.mask(taken.values_list("id", flat=True))
+    for course_type in course_types:
+        assert graph.is_eligible(course_type.id, taken_mask) == (
+            course_type.id in query_eligible
+        )
+        course = baker.make(models.Course, type=course_type, capacity=5)
+        try:
+            cart.validate_new_courses([course])
+        except ValidationError:
+            assert course_type.id not in query_eligible
+        else:
+            assert course_type.id in query_eligible
@@ -1,7 +1,18 @@
+import json
+from datetime import timedelta
+
 import pytest
+import stripe
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
 from model_bakery import baker
 
-from registration import models, rest_views
+from registration import catalog, models, rest_views, serializers
 
 pytestmark = pytest.mark.django_db
 
@@ -39,3 +50,498 @@ def test_fulfill_order(create_registration_form, fake):
     assert list(models.Course.objects.filter(participants=user).order_by("pk")) == list(
         models.Course.objects.filter(id__in=course_ids).order_by("pk")
     )
+
+
+def _order(courses):
+    return [
+        {
+            "course_id": str(course.id),
+            "product_id": "prod_1",
+            "price_id": "price_1",
+            "coupon_id": "",
+            "amount_paid": 10000,
+        }
+        for course in courses
+    ]
+
+
+def test_fulfill_order_query_count(django_assert_max_num_queries):
+    user = baker.make(models.User)
+    courses = baker.make(models.Course, capacity=5, _quantity=4)
+
+    with django_assert_max_num_queries(12):
+        rest_views.fulfill_order(_order(courses), user.id, checkout_session_id="cs_1")
+
+    assert models.CourseBought.objects.count() == 4
+    assert set(models.Course.objects.values_list("participant_count", flat=True)) == {1}
+
+
+def test_fulfill_order_is_all_or_nothing(create_registration_form):
+    user = baker.make(models.User)
+    create_registration_form(user)
+    courses = baker.make(models.Course, capacity=5, _quantity=2)
+    full_course = baker.make(models.Course, capacity=1)
+    full_course.participants.add(baker.make(models.User))
+    baker.make(models.CartItem, cart=user.usercart, course=courses[0])
+
+    with pytest.raises(ValidationError):
+        rest_views.fulfill_order(_order([*courses, full_course]), user.id)
+
+    assert not models.PaymentRecord.objects.exists()
+    assert not models.CourseBought.objects.exists()
+    assert not user.participants.exists()
+    assert user.usercart.cartitem_set.exists()
+    assert not models.Course.objects.filter(
+        pk__in=[course.pk for course in courses], participant_count__gt=0
+    ).exists()
+
+
+def _add_course_types(count, user):
+    for _ in range(count):
+        course_type = baker.make(models.CourseType, visible=True)
+        for capacity in (2, 1):
+            course = baker.make(models.Course, type=course_type, capacity=capacity)
+            baker.make(models.CourseDate, course=course, _quantity=2)
+            course.participants.add(baker.make(models.User))
+            if course.is_full:
+                baker.make(models.WaitList, course=course, user=user)
+
+
+def test_eligible_courses_query_count_is_constant(
+    client, create_registration_form, django_assert_num_queries
+):
+    user = baker.make(models.User)
+    create_registration_form(user)
+    client.force_login(user)
+    url = reverse("api:eligible_courses-list")
+
+    _add_course_types(1, user)
+    with CaptureQueriesContext(connection) as small_catalog:
+        response = client.get(url)
+    assert len(response.json()) == 1
+
+    _add_course_types(10, user)
+    with django_assert_num_queries(len(small_catalog)):
+        response = client.get(url)
+
+    course_types = response.json()
+    assert len(course_types) == 11
+    for course_type in course_types:
+        open_course, full_course = sorted(
+            course_type["course_set"], key=lambda course: -course["capacity"]
+        )
+        assert open_course["spots_left"] == 1
+        assert not open_course["is_full"]
+        assert "id" not in open_course["user_on_wait_list"]
+        assert full_course["is_full"]
+        assert full_course["user_on_wait_list"]["id"]
+        assert not full_course["user_enrolled"]
+
+
+def test_seat_availability_only_returns_changed_courses(client, freezer):
+    client.force_login(baker.make(models.User))
+    url = reverse("api:seat_availability-list")
+    changed_course, unchanged_course = baker.make(
+        models.Course, capacity=2, _quantity=2
+    )
+
+    response = client.get(url).json()
+    assert {course["id"] for course in response["courses"]} == {
+        str(changed_course.id),
+        str(unchanged_course.id),
+    }
+
+    freezer.tick(60)
+    cursor = client.get(url).json()["cursor"]
+    freezer.tick(60)
+    changed_course.participants.add(baker.make(models.User))
+
+    response = client.get(url, {"since": cursor}).json()
+    assert response["courses"] == [
+        {
+            "id": str(changed_course.id),
+            "spots_left": 1,
+            "is_full": False,
+            "num_on_wait_list": 0,
+        }
+    ]
+
+
+def test_wait_list_view_lists_places(client):
+    user = baker.make(models.User)
+    client.force_login(user)
+    course = baker.make(models.Course, capacity=0)
+    baker.make(models.WaitList, course=course, _quantity=2)
+    wait_list = baker.make(models.WaitList, course=course, user=user)
+
+    response = client.get(reverse("api:wait_list-list"))
+    assert response.json() == [
+        {"id": str(wait_list.id), "course": str(course.id), "place": 3}
+    ]
+
+
+def _stripe_event(event_id, event_type="checkout.session.completed"):
+    return {"id": event_id, "type": event_type, "data": {"object": {}}}
+
+
+def test_stripe_webhook_stores_events_once(client, monkeypatch):
+    def construct_event(payload, sig_header, secret):
+        return stripe.Event.construct_from(json.loads(payload), None)
+
+    monkeypatch.setattr("stripe.Webhook.construct_event", construct_event)
+    url = reverse("stripe_webhook")
+    for event in (_stripe_event("evt_1"), _stripe_event("evt_1")):
+        response = client.post(
+            url, event, content_type="application/json", HTTP_STRIPE_SIGNATURE="sig"
+        )
+        assert response.status_code == 200
+    client.post(
+        url,
+        _stripe_event("evt_2", "customer.created"),
+        content_type="application/json",
+        HTTP_STRIPE_SIGNATURE="sig",
+    )
+
+    assert list(models.StripeEvent.objects.values_list("event_id", "type")) == [
+        ("evt_1", "checkout.session.completed")
+    ]
+
+
+def test_process_stripe_events(monkeypatch):
+    processed = []
+
+    def process_stripe_event(event):
+        if event["id"] == "evt_bad":
+            raise ValueError("bad event")
+        processed.append(event["id"])
+
+    monkeypatch.setattr(rest_views, "process_stripe_event", process_stripe_event)
+    for event_id in ("evt_1", "evt_bad", "evt_2"):
+        baker.make(
+            models.StripeEvent, event_id=event_id, payload=_stripe_event(event_id)
+        )
+
+    call_command("process_stripe_events")
+    call_command("process_stripe_events")
+
+    assert processed == ["evt_1", "evt_2"]
+    bad_event = models.StripeEvent.objects.get(event_id="evt_bad")
+    assert bad_event.processed is None
+    assert bad_event.attempts == 2
+    assert "bad event" in bad_event.error
+    assert not models.StripeEvent.objects.filter(processed=None, attempts=0).exists()
+
+
+def test_process_stripe_events_skips_claimed_events(monkeypatch):
+    processed = []
+    monkeypatch.setattr(
+        rest_views, "process_stripe_event", lambda event: processed.append(event["id"])
+    )
+    now = timezone.now()
+    for event_id, claimed_until in (
+        ("evt_claimed", now + timedelta(minutes=1)),
+        ("evt_lapsed", now - timedelta(minutes=1)),
+    ):
+        baker.make(
+            models.StripeEvent,
+            event_id=event_id,
+            payload=_stripe_event(event_id),
+            claimed_until=claimed_until,
+        )
+
+    call_command("process_stripe_events", max_seconds=0)
+    assert processed == []
+
+    call_command("process_stripe_events")
+    assert processed == ["evt_lapsed"]
+    lapsed = models.StripeEvent.objects.get(event_id="evt_lapsed")
+    assert lapsed.claimed_until is None
+    assert lapsed.attempts == 1
+
+
+def test_checkout_fulfillment_uses_pending_checkout(
+    monkeypatch, create_registration_form
+):
+    user = baker.make(models.User)
+    create_registration_form(user)
+    courses = baker.make(models.Course, capacity=5, _quantity=3)
+    prices = ["price_a", "price_a", "price_b"]
+    pending_checkout = baker.make(
+        models.PendingCheckout,
+        user=user,
+        session_id="cs_1",
+        courses=[
+            {"course_id": str(course.id), "price_id": price_id}
+            for course, price_id in zip(courses, prices)
+        ],
+    )
+    # Line items in a different order than the courses were sent
+    line_items = stripe.ListObject.construct_from(
+        {
+            "object": "list",
+            "data": [
+                {
+                    "price": {"id": price_id, "product": f"prod_{price_id}"},
+                    "amount_total": 10000,
+                }
+                for price_id in reversed(prices)
+            ],
+        },
+        None,
+    )
+
+    def retrieve_product(*args, **kwargs):
+        raise AssertionError("fulfillment should not retrieve products")
+
+    monkeypatch.setattr(
+        "stripe.checkout.Session.list_line_items", lambda *a, **k: line_items
+    )
+    monkeypatch.setattr("stripe.Product.retrieve", retrieve_product)
+    event = stripe.Event.construct_from(
+        {
+            "id": "evt_1",
+            "type": "checkout.session.completed",
+            "data": {
+                "object": {
+                    "id": "cs_1",
+                    "client_reference_id": str(pending_checkout.id),
+                    "payment_intent": "pi_1",
+                    "metadata": {"user_id": str(user.id)},
+                }
+            },
+        },
+        None,
+    )
+
+    rest_views.process_stripe_event(event)
+
+    assert set(models.Course.objects.filter(participants=user)) == set(courses)
+    assert sorted(models.CourseBought.objects.values_list("course", "price_id")) == (
+        sorted(zip((course.id for course in courses), prices))
+    )
+
+    pending_checkout.courses = pending_checkout.courses[:2]
+    with pytest.raises(ValueError):
+        rest_views.checkout_manifest_courses(pending_checkout, line_items)
+
+
+def test_checkout_session_keeps_courses_out_of_metadata(
+    client, freezer, monkeypatch, create_registration_form, registration_settings
+):
+    user = baker.make(models.User)
+    create_registration_form(user)
+    course_type = baker.make(
+        models.CourseType,
+        cost=10000,
+        stripe_price_id="price_1",
+        stripe_price_amount=10000,
+    )
+    courses = baker.make(models.Course, type=course_type, capacity=5, _quantity=20)
+    models.CartItem.objects.bulk_create(
+        models.CartItem(cart=user.usercart, course=course) for course in courses
+    )
+    sessions = []
+
+    def create_session(**kwargs):
+        sessions.append(kwargs)
+        return stripe.checkout.Session.construct_from({"id": "cs_1"}, None)
+
+    monkeypatch.setattr("stripe.checkout.Session.create", create_session)
+    freezer.move_to("2022-02-01")
+    client.force_login(user)
+
+    response = client.post(reverse("checkout_session"))
+    assert response.json() == {"id": "cs_1"}
+    (session,) = sessions
+    assert all(len(str(value)) <= 500 for value in session["metadata"].values())
+    pending_checkout = models.PendingCheckout.objects.get(
+        pk=session["client_reference_id"]
+    )
+    assert pending_checkout.session_id == "cs_1"
+    assert sorted(course["course_id"] for course in pending_checkout.courses) == (
+        sorted(str(course.id) for course in courses)
+    )
+    assert len(session["line_items"]) == 20
+
+
+def test_bulk_add_course_with_prerequisite(
+    client, create_registration_form, django_assert_max_num_queries
+):
+    user = baker.make(models.User)
+    create_registration_form(user)
+    pre_req_type = baker.make(models.CourseType)
+    course_type = baker.make(models.CourseType, requirement=pre_req_type)
+    pre_req_course = baker.make(models.Course, type=pre_req_type, capacity=5)
+    course = baker.make(models.Course, type=course_type, capacity=5)
+    client.force_login(user)
+    url = reverse("api:cart_item-bulk")
+    models.PrerequisiteGraph.load()
+
+    with django_assert_max_num_queries(9):
+        response = client.post(
+            url,
+            {"courses": [str(course.id), str(pre_req_course.id)]},
+            content_type="application/json",
+        )
+    assert response.status_code == 201
+    assert set(user.usercart.cartitem_set.values_list("course", flat=True)) == {
+        course.id,
+        pre_req_course.id,
+    }
+
+    response = client.post(
+        url, {"courses": [str(course.id)]}, content_type="application/json"
+    )
+    assert response.status_code == 400
+    assert "already has this course type" in response.json()[0]
+
+
+def test_bulk_add_course_missing_prerequisite(client, create_registration_form):
+    user = baker.make(models.User)
+    create_registration_form(user)
+    pre_req_type = baker.make(models.CourseType, name="Basic")
+    course = baker.make(
+        models.Course,
+        type=baker.make(models.CourseType, requirement=pre_req_type),
+        capacity=5,
+    )
+    client.force_login(user)
+
+    response = client.post(
+        reverse("api:cart_item-bulk"),
+        {"courses": [str(course.id)]},
+        content_type="application/json",
+    )
+    assert response.status_code == 400
+    assert "(Basic)" in response.json()[0]
+    assert not user.usercart.cartitem_set.exists()
+
+
+def test_mutations_return_requested_sign_up_state(client, create_registration_form):
+    user = baker.make(models.User)
+    create_registration_form(user)
+    course = baker.make(
+        models.Course, type=baker.make(models.CourseType, cost=5000), capacity=5
+    )
+    client.force_login(user)
+
+    response = client.post(
+        reverse("api:cart_item-list") + "?include=eligible_courses,cart",
+        {"course": str(course.id)},
+    )
+    assert response.status_code == 201
+    data = response.json()
+    cart_item_id = data["item"]["id"]
+    assert [type_["eligible"] for type_ in data["eligible_courses"]] == [False]
+    assert [item["id"] for item in data["cart"]["items"]] == [cart_item_id]
+    assert data["cart"]["cost"] == 5000
+
+    response = client.delete(
+        reverse("api:cart_item-detail", args=[cart_item_id]) + "?include=cart"
+    )
+    assert response.status_code == 200
+    assert response.json() == {"item": None, "cart": {"items": [], "cost": 0}}
+
+    response = client.delete(reverse("api:cart_item-detail", args=[cart_item_id]))
+    assert response.status_code == 404
+
+
+def test_cart_cost_includes_cart_items(client, create_registration_form):
+    user = baker.make(models.User)
+    create_registration_form(user)
+    client.force_login(user)
+
+    assert client.get(reverse("api:cart_cost-list")).json() == {"cost": 0}
+    assert client.get(reverse("api:cart_cost-list") + "?include=cart").json() == {
+        "item": {"cost": 0},
+        "cart": {"items": [], "cost": 0},
+    }
+
+
+@pytest.mark.parametrize(
+    "url_name",
+    ["api:eligible_courses-list", "api:cart_item-list", "api:cart_cost-list"],
+)
+def test_sign_up_state_etags(client, create_registration_form, url_name):
+    user = baker.make(models.User)
+    create_registration_form(user)
+    course_type = baker.make(models.CourseType, visible=True)
+    course = baker.make(models.Course, type=course_type, capacity=5)
+    client.force_login(user)
+    url = reverse(url_name)
+
+    etag = client.get(url)["ETag"]
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+
+    changes = [
+        lambda: models.CartItem.objects.create(cart=user.usercart, course=course),
+        lambda: course.participants.add(baker.make(models.User)),
+        lambda: baker.make(models.CourseDate, course=course),
+        lambda: user.usercart.cartitem_set.all().delete(),
+    ]
+    for change in changes:
+        change()
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response["ETag"] != etag
+        etag = response["ETag"]
+
+
+def test_eligible_courses_snapshot_matches_serializer(
+    client, create_registration_form, django_assert_max_num_queries
+):
+    user = baker.make(models.User)
+    create_registration_form(user)
+    _add_course_types(3, user)
+    requirement = models.CourseType.objects.first()
+    course_type = baker.make(models.CourseType, visible=True, requirement=requirement)
+    course = baker.make(models.Course, type=course_type, capacity=3)
+    baker.make(models.CourseDate, course=course)
+    course.participants.add(user)
+    baker.make(models.CourseType, visible=False)
+    client.force_login(user)
+
+    response = client.get(reverse("api:eligible_courses-list"))
+    view = rest_views.ListEligibleCoursesView(
+        request=response.wsgi_request, format_kwarg=None
+    )
+    expected = serializers.CourseTypeSerializer(
+        view.get_queryset(), many=True, context={"user": user}
+    ).data
+    expected = json.loads(json.dumps(expected, cls=DjangoJSONEncoder))
+    assert len(response.json()) == len(expected) == 4
+    for snapshot_type, expected_type in zip(
+        sorted(response.json(), key=lambda course_type: course_type["name"]),
+        sorted(expected, key=lambda course_type: course_type["name"]),
+    ):
+        snapshot_type["course_set"].sort(key=lambda course: course["id"])
+        expected_type["course_set"].sort(key=lambda course: course["id"])
+        assert snapshot_type == expected_type
+
+    with django_assert_max_num_queries(7):
+        client.get(reverse("api:eligible_courses-list"))
+
+
+def test_eligible_courses_with_stale_snapshot(client, create_registration_form):
+    user = baker.make(models.User)
+    create_registration_form(user)
+    kept, deleted = baker.make(models.CourseType, visible=True, _quantity=2)
+    for course_type in (kept, deleted):
+        baker.make(models.Course, type=course_type, capacity=3)
+    stale_snapshot = catalog.catalog_cache.get()
+
+    deleted.delete()
+    # Another instance still holds the snapshot from before the delete
+    catalog.catalog_cache.value = stale_snapshot
+    catalog.catalog_cache.next_check = float("inf")
+    data = {
+        course_type["name"]: course_type
+        for course_type in catalog.eligible_courses_data(user)
+    }
+    assert data[kept.name]["eligible"]
+    assert data[deleted.name]["course_set"] == []
+
+    graph = models.PrerequisiteGraph.build()
+    assert graph.bit(deleted.id) == 0
+    assert not graph.is_eligible(deleted.id, graph.mask([deleted.id]))
@@ -0,0 +1,62 @@
+import io
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from django.core.management import call_command
+from model_bakery import baker
+
+from registration import catalog, models
+from SkagitRegistration import asgi, clients, warmup
+
+
+@pytest.mark.django_db(transaction=True)
+def test_asgi_handler_answers_warmup_event(registration_settings):
+    response = asgi.handler(warmup.warmup_event(hold_seconds=0), None)
+    assert response["instance"] == warmup.INSTANCE_ID
+    assert models.registration_settings_cache.value is not None
+    assert catalog.catalog_cache.value is not catalog.catalog_cache._missing
+
+    assert asgi.handler(warmup.warmup_event(hold_seconds=0), None)["cold"] is False
+
+
+def _opening_in(delta):
+    now = datetime.now(tz=timezone.utc)
+    baker.make(
+        models.RegistrationSettings,
+        early_registration_open=now - timedelta(days=7),
+        registration_open=now + delta,
+        registration_close=now + timedelta(days=30),
+    )
+
+
+@pytest.fixture
+def lambda_client(monkeypatch, settings):
+    settings.WEB_LAMBDA_FUNCTION_NAME = "web"
+    invocations = []
+
+    class Client:
+        def invoke(self, FunctionName, Payload):
+            invocations.append((FunctionName, json.loads(Payload)))
+            result = {"instance": len(invocations), "cold": True, "seconds": 0.1}
+            return {
+                "StatusCode": 200,
+                "Payload": io.BytesIO(json.dumps(result).encode()),
+            }
+
+    monkeypatch.setattr(clients.boto3, "client", lambda service: Client())
+    return invocations
+
+
+@pytest.mark.django_db
+def test_prewarm_lambdas_before_opening(lambda_client):
+    _opening_in(timedelta(minutes=10))
+    call_command("prewarm_lambdas", concurrency=4, hold_seconds=1)
+    assert lambda_client == [("web", warmup.warmup_event(1))] * 4
+
+
+@pytest.mark.django_db
+def test_prewarm_lambdas_skips_when_not_opening(lambda_client):
+    _opening_in(timedelta(hours=2))
+    call_command("prewarm_lambdas")
+    assert lambda_client == []
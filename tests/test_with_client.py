@@ -1,5 +1,11 @@
+import csv
+import io
+import zipfile
+
 import pytest
-from django.contrib.auth.models import User
+from django.contrib.auth.models import Group, User
+from django.db import connection
+from django.urls import reverse
 from model_bakery import baker
 
 from registration import models
@@ -36,3 +42,140 @@ def test_logged_in_access(fill_db, client, url, status_code):
     client.force_login(User.objects.get_or_create(username="test_user")[0])
     response = client.get(url)
     assert response.status_code == status_code[1]
+
+
+@pytest.fixture
+def instructor_client(client):
+    instructor = baker.make(User)
+    instructor.groups.add(baker.make(Group, name=models.INSTRUCTOR_GROUP))
+    client.force_login(instructor)
+    return client
+
+
+def test_current_registrations_query_count(
+    instructor_client, django_assert_max_num_queries
+):
+    client = instructor_client
+
+    courses = baker.make(models.Course, capacity=1000, _quantity=4)
+    for course in courses:
+        baker.make(models.CourseDate, course=course, _quantity=2)
+    registrants = User.objects.bulk_create(
+        baker.prepare(User, _quantity=1000, _save_related=False)
+    )
+    models.Course.participants.through.objects.bulk_create(
+        models.Course.participants.through(course=courses[i % 3], user=registrant)
+        for i, registrant in enumerate(registrants)
+    )
+    models.WaitList.objects.bulk_create(
+        models.WaitList(course=courses[3], user=registrant)
+        for registrant in registrants[::10]
+    )
+    baker.make(
+        models.WaitListInvoice, course=courses[3], user=registrants[0], _quantity=5
+    )
+
+    with django_assert_max_num_queries(15):
+        response = client.get("/instructor/current-registrations/")
+    assert response.status_code == 200
+    assert registrants[-1].username in response.content.decode()
+
+
+def test_participant_csv_exports(instructor_client, create_registration_form):
+    course_type = baker.make(models.CourseType, abbreviation="BMC", visible=True)
+    course, empty_course = baker.make(
+        models.Course, type=course_type, capacity=10, _quantity=2
+    )
+    participants = baker.make(User, _quantity=3)
+    for participant in participants:
+        create_registration_form(participant)
+    course.participants.add(*participants)
+
+    response = instructor_client.get(
+        reverse("instructor:participant_csv", kwargs={"course_pk": course.pk})
+    )
+    rows = list(csv.reader(io.StringIO(response.getvalue().decode())))
+    assert rows[0] == list(models.PARTICIPANT_FIELDS)
+    assert sorted(row[2] for row in rows[1:]) == sorted(
+        participant.email for participant in participants
+    )
+
+    response = instructor_client.get(reverse("instructor:participant_csv_zip"))
+    with zipfile.ZipFile(io.BytesIO(response.getvalue())) as archive:
+        exports = {
+            name: list(csv.reader(io.StringIO(archive.read(name).decode())))
+            for name in archive.namelist()
+        }
+    assert set(exports) == {
+        f"BMC {course.specifics}.csv",
+        f"BMC {empty_course.specifics}.csv",
+    }
+    assert sorted(exports[f"BMC {course.specifics}.csv"]) == sorted(rows)
+    assert exports[f"BMC {empty_course.specifics}.csv"] == [
+        list(models.PARTICIPANT_FIELDS)
+    ]
+
+
+def test_refund_page_renders_from_recorded_amount(
+    client, freezer, monkeypatch, registration_settings
+):
+    def retrieve(*args, **kwargs):
+        raise AssertionError("the refund page should not call Stripe")
+
+    monkeypatch.setattr("stripe.Price.retrieve", retrieve)
+    monkeypatch.setattr("stripe.Coupon.retrieve", retrieve)
+    user = baker.make(User)
+    course = baker.make(models.Course, capacity=5)
+    baker.make(models.CourseDate, course=course, start="2022-03-20T00:00:00Z")
+    course.participants.add(user)
+    course_bought = baker.make(
+        models.CourseBought,
+        payment_record=baker.make(models.PaymentRecord, user=user),
+        course=course,
+        coupon_id="coupon_1",
+        amount_paid=9000,
+    )
+    models.RegistrationSettings.objects.update(cancellation_fee=1500)
+    freezer.move_to("2022-02-01")
+    client.force_login(user)
+
+    response = client.get(reverse("refund", args=[course_bought.course.pk]))
+    assert response.status_code == 200
+    assert response.context["purchase_price"] == models.human_readable_cost(9000)
+    assert response.context["refund_amount"] == models.human_readable_cost(7500)
+
+
+def test_refund_offers_seat_to_wait_list_after_commit(
+    client, freezer, monkeypatch, registration_settings
+):
+    monkeypatch.setattr("stripe.Refund.create", lambda **kwargs: {"id": "re_1"})
+    savepoints = len(connection.savepoint_ids)
+    offered = []
+
+    def handle_wait_list(course):
+        offered.append((course.pk, len(connection.savepoint_ids)))
+
+    monkeypatch.setattr(models, "handle_wait_list", handle_wait_list)
+    user = baker.make(User)
+    course = baker.make(models.Course, capacity=1)
+    baker.make(models.CourseDate, course=course, start="2022-03-20T00:00:00Z")
+    course.participants.add(user)
+    baker.make(models.WaitList, course=course)
+    course_bought = baker.make(
+        models.CourseBought,
+        payment_record=baker.make(models.PaymentRecord, user=user),
+        course=course,
+        amount_paid=9000,
+    )
+    models.RegistrationSettings.objects.update(cancellation_fee=1500)
+    freezer.move_to("2022-02-01")
+    client.force_login(user)
+
+    response = client.post(reverse("refund", args=[course.pk]))
+    assert response.status_code == 302
+    assert offered == [(course.pk, savepoints)]
+    course_bought.refresh_from_db()
+    assert course_bought.refunded
+    course.refresh_from_db()
+    assert course.capacity == 0
+    assert course.participant_count == 0